@@ -1,20 +1,80 @@
 import os
-from dotenv import load_dotenv
 
-load_dotenv()  # .envファイルから環境変数を読み込む
-import requests
+# コールドスタートを短くするため、google-genai・aiohttp・requests は初回利用時に
+# 読み込む（gemini_client() / _discord_session() / _http_session()）
+if not os.getenv("VERCEL"):
+    from dotenv import load_dotenv
+
+    load_dotenv()  # ローカル実行時のみ .envファイルから環境変数を読み込む
 import datetime
-from google import genai
-from google.genai import types
+import asyncio
 import json
 from flask import Flask, request, jsonify
 import logging
 import sys
-
-DISCORD_TOKEN = os.environ["DISCORD_TOKEN"]
-GUILD_ID = "1024957065686433802"
-WEBHOOK_URL = os.environ["DISCORD_WEBHOOK_URL"]
+import sqlite3
+import tempfile
+import contextlib
+import threading
+import time
+import re
+import collections
+import concurrent.futures
+import contextvars
+import hashlib
+import uuid
+import unicodedata
+import io
+import mmap
+import struct
+import zlib
+from urllib.parse import urlparse
+
+DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")  # スナップショットの再生時は不要
+GUILD_ID = os.getenv("DISCORD_GUILD_ID", "1024957065686433802")
+WEBHOOK_URL = os.getenv("DISCORD_WEBHOOK_URL")
 JST = datetime.timezone(datetime.timedelta(hours=9), name="JST")
+WEEKDAYS = ["月", "火", "水", "木", "金", "土", "日"]
+DISCORD_API_BASE = os.getenv("DISCORD_API_BASE", "https://discord.com/api/v10")
+DISCORD_TIMEOUT = 15
+DISCORD_EPOCH_MS = 1420070400000
+MESSAGES_PAGE_SIZE = 100
+ARCHIVED_THREADS_PAGE_SIZE = 50
+# Webhook 1メッセージあたりの上限（埋め込みの説明文・個数・合計文字数）
+EMBED_DESCRIPTION_LIMIT = 4096
+EMBEDS_PER_MESSAGE = 10
+EMBED_TOTAL_LIMIT = 6000
+# レート制限: 各バケットで残り枠をこの数だけ残して待機する
+RATE_LIMIT_HEADROOM = int(os.getenv("RATE_LIMIT_HEADROOM", "1"))
+# Botトークン全体のグローバル制限（リクエスト/秒）
+RATE_LIMIT_GLOBAL_PER_SEC = int(os.getenv("RATE_LIMIT_GLOBAL_PER_SEC", "50"))
+DISCORD_MAX_RETRIES = int(os.getenv("DISCORD_MAX_RETRIES", "3"))
+# チャンネル・スレッド収集の同時接続数
+COLLECT_CONCURRENCY = int(os.getenv("COLLECT_CONCURRENCY", "8"))
+# /api/metrics 用に保存する実行記録の件数
+RUN_METRICS_HISTORY = int(os.getenv("RUN_METRICS_HISTORY", "200"))
+
+# 複数ギルドの設定（JSON文字列、またはJSONファイルのパス）。未設定なら
+# GUILD_ID / DISCORD_WEBHOOK_URL / MEMBER_LIST / EXCLUDED_CHANNEL_IDS の1ギルドのみ
+GUILDS_CONFIG = os.getenv("GUILDS_CONFIG")
+GUILDS_CONFIG_FILE = os.getenv("GUILDS_CONFIG_FILE")
+MULTI_GUILD = bool(GUILDS_CONFIG or GUILDS_CONFIG_FILE)
+# 日次サマリーの保存日数（週次・月次のまとめの材料）と、まとめ作成時に
+# 保存済みサマリーのない日を生ログから作り直す上限日数
+DAILY_SUMMARY_RETENTION_DAYS = float(os.getenv("DAILY_SUMMARY_RETENTION_DAYS", "400"))
+ROLLUP_MAX_BACKFILL_DAYS = int(os.getenv("ROLLUP_MAX_BACKFILL_DAYS", "7"))
+# メンバー・チャンネル・ロール名の一覧を取り直す間隔（時間）
+GUILD_DIRECTORY_TTL_HOURS = float(os.getenv("GUILD_DIRECTORY_TTL_HOURS", "24"))
+MEMBERS_PAGE_SIZE = 1000
+# 同時に処理するギルド数と、全ギルドで共有するGemini同時呼び出し数の上限
+GUILD_CONCURRENCY = int(os.getenv("GUILD_CONCURRENCY", "4"))
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "4"))
+# 同じギルド・同じ対象日の実行は1つだけにする（リース）。実行中は TTL の1/3ごとに
+# 延長し、落ちた実行のリースは TTL で切れる。完了後 REUSE 秒は再実行せず結果を返す
+LEASE_TTL_SECONDS = float(os.getenv("LEASE_TTL_SECONDS", "120"))
+LEASE_REUSE_SECONDS = float(os.getenv("LEASE_REUSE_SECONDS", "600"))
+# 実行中のジョブに相乗りした呼び出しが結果を待つ上限（秒）
+LEASE_WAIT_SECONDS = float(os.getenv("LEASE_WAIT_SECONDS", "280"))
 
 # 分析対象外のチャンネルIDリスト
 EXCLUDED_CHANNEL_IDS = {
@@ -23,6 +83,23 @@ EXCLUDED_CHANNEL_IDS = {
 
 DISCORD_LOG_WEBHOOK_URL = os.getenv("DISCORD_LOG_WEBHOOK_URL")
 
+# 実行間で引き継ぐ状態（メッセージストア等）の保存先。Vercelでは/tmpのみ書き込み可
+STATE_DIR = os.getenv(
+    "SUMMARY_STATE_DIR", os.path.join(tempfile.gettempdir(), "team-summary-bot")
+)
+# メッセージストアの保持日数（これより古いメッセージは削除）
+MESSAGE_STORE_RETENTION_DAYS = float(os.getenv("MESSAGE_STORE_RETENTION_DAYS", "8"))
+# 収集したDiscordのデータをスナップショットに記録する（1で有効）。保存先と保持日数
+SNAPSHOT_RECORD = os.getenv("SNAPSHOT_RECORD", "0") == "1"
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(STATE_DIR, "snapshots"))
+SNAPSHOT_RETENTION_DAYS = float(os.getenv("SNAPSHOT_RETENTION_DAYS", "14"))
+
+# 定型・ほぼ同一の投稿をまとめる前処理（0で無効）と、まとめる最小件数
+NOISE_REDUCTION = os.getenv("NOISE_REDUCTION", "1") == "1"
+NOISE_MIN_REPEATS = int(os.getenv("NOISE_MIN_REPEATS", "3"))
+
+# 表示名の手動上書き（member_name）。それ以外のメンバーはギルドのメンバー一覧
+# （GuildDirectory）から自動で解決する
 MEMBER_LIST = [
     {
         "member_name": "酒井",
@@ -112,7 +189,7 @@ MEMBER_LIST = [
         "member_name": "小島",
         "id": "1045228812998291469",
         "username": "kojima_minako",
-        "global_gname": "KojimaMinako",
+        "global_name": "KojimaMinako",
         "nick": None,
     },
     {
@@ -131,15 +208,78 @@ MEMBER_LIST = [
     },
 ]
 
-ID_TO_MEMBER_NAME = {
-    e["id"]: e["member_name"] for e in MEMBER_LIST if e.get("member_name")
-}
+
+class GuildConfig:
+    # 要約対象ギルド1つ分の設定（投稿先Webhook・メンバー名・除外チャンネル）
+    def __init__(
+        self, guild_id, webhook_url, members=(), excluded_channel_ids=(), name=None
+    ):
+        self.guild_id = str(guild_id)
+        self.webhook_url = webhook_url
+        self.name = name
+        self.excluded_channel_ids = set(excluded_channel_ids)
+        self.member_names = {
+            e["id"]: e["member_name"] for e in members if e.get("member_name")
+        }
+
+    @property
+    def label(self):
+        return self.name or self.guild_id
+
+    @classmethod
+    def from_dict(cls, entry):
+        # Webhook URLは設定に直接書くか、webhook_url_env で環境変数名を指定する
+        webhook_url = entry.get("webhook_url") or os.environ[entry["webhook_url_env"]]
+        return cls(
+            entry["guild_id"],
+            webhook_url,
+            entry.get("members", []),
+            entry.get("excluded_channel_ids", []),
+            entry.get("name"),
+        )
+
+
+DEFAULT_GUILD = GuildConfig(GUILD_ID, WEBHOOK_URL, MEMBER_LIST, EXCLUDED_CHANNEL_IDS)
+
+# 処理中のギルド（ギルドごとのスレッドで設定し、未設定なら DEFAULT_GUILD）
+_current_guild = contextvars.ContextVar("current_guild", default=None)
+
+
+def current_guild():
+    return _current_guild.get() or DEFAULT_GUILD
+
+
+def load_guild_configs():
+    # 設定の誤ったギルド・投稿先Webhookのないギルドはログに残して除外し、
+    # 残りのギルドは処理する（収集・要約の後で投稿できずに失敗しないよう先に弾く）
+    if not MULTI_GUILD:
+        guilds = [DEFAULT_GUILD]
+    else:
+        raw = GUILDS_CONFIG
+        if not raw:
+            with open(GUILDS_CONFIG_FILE, encoding="utf-8") as f:
+                raw = f.read()
+        guilds = []
+        for entry in json.loads(raw):
+            try:
+                guilds.append(GuildConfig.from_dict(entry))
+            except (KeyError, TypeError, AttributeError) as e:
+                logger.error(f"guild config skipped: {entry!r:.200} ({e!r})")
+    for guild in guilds:
+        if not guild.webhook_url:
+            logger.error(f"guild config skipped: {guild.label} has no webhook URL")
+    return [g for g in guilds if g.webhook_url]
 
 
 def resolve_member_name(author: dict) -> str:
+    # MEMBER_LIST の上書き → ギルドのメンバー一覧（ニックネーム優先）→ 投稿者情報
     uid = (author or {}).get("id")
-    if uid and uid in ID_TO_MEMBER_NAME:
-        return ID_TO_MEMBER_NAME[uid]
+    member_names = current_guild().member_names
+    if uid and uid in member_names:
+        return member_names[uid]
+    member = guild_directory().members.get(uid) if uid else None
+    if member:
+        return member
     return (
         (author or {}).get("global_name")
         or (author or {}).get("username")
@@ -148,32 +288,139 @@ def resolve_member_name(author: dict) -> str:
 
 
 class DiscordWebhookHandler(logging.Handler):
-    def __init__(self, webhook_url, username="TeamSummaryBot Logs"):
+    # ログはキューに積むだけにし、バックグラウンドスレッドがまとめて送信する。
+    # 2000文字以内に詰めて送り、サイズ・時間・終了時のいずれかでフラッシュする。
+    # Discordが遅くキューが溢れた場合は古いものから捨てる（パイプラインを止めない）。
+    # フラッシュ・終了の要求はキューとは別に持つので、ログと一緒に捨てられることはない
+    MAX_CONTENT = 2000
+
+    def __init__(
+        self,
+        webhook_url,
+        username="TeamSummaryBot Logs",
+        *,
+        max_queue=1000,
+        flush_interval=2.0,
+    ):
         super().__init__()
         self.webhook_url = webhook_url
         self.username = username
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._records = collections.deque()
+        self._cond = threading.Condition()
+        self._flush_requested = 0  # flush() の要求ごとに増やす通し番号
+        self._flush_done = 0  # 送信スレッドが送り終えた要求の番号
+        self._stopping = False
+        # 送信スレッドは最初のログが来たときに起動する（import時には起動しない）
+        self._thread = threading.Thread(
+            target=self._run, name="discord-log-sender", daemon=True
+        )
 
     def emit(self, record):
         try:
-            msg = self.format(record)
-            # Discordは2000文字制限。少し余裕を見て分割。
-            for i in range(0, len(msg), 1800):
-                chunk = msg[i : i + 1800]
-                data = {"content": f"[{record.levelname}] {chunk}"}
-                response = requests.post(
+            msg = f"[{record.levelname}] {self.format(record)}"
+        except Exception:
+            self.handleError(record)
+            return
+        if self._thread.ident is None:  # emit は Handler のロック内で呼ばれる
+            self._thread.start()
+        with self._cond:
+            if len(self._records) >= self.max_queue:
+                self._records.popleft()
+                self.dropped += 1
+            self._records.append(msg)
+            self._cond.notify()
+
+    def flush(self, timeout=10):
+        # 溜まっているログを送り切るまで待つ（サーバーレスでは応答前に呼ぶ）
+        if not self._thread.is_alive():
+            return
+        with self._cond:
+            self._flush_requested += 1
+            target = self._flush_requested
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: self._flush_done >= target, timeout)
+
+    def close(self):
+        if self._thread.is_alive():
+            with self._cond:
+                self._stopping = True
+                self._cond.notify_all()
+            self._thread.join(10)
+        super().close()
+
+    def _run(self):
+        pending, size, deadline = [], 0, None
+        while True:
+            with self._cond:
+                while not (
+                    self._records
+                    or self._flush_requested > self._flush_done
+                    or self._stopping
+                ):
+                    timeout = None
+                    if deadline is not None:
+                        timeout = deadline - time.monotonic()
+                        if timeout <= 0:
+                            break
+                    self._cond.wait(timeout)
+                records = list(self._records)
+                self._records.clear()
+                flush_to = self._flush_requested
+                flushing = flush_to > self._flush_done
+                stopping = self._stopping
+            for msg in records:
+                pending.append(msg)
+                size += len(msg) + 1
+            if pending and deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+            due = deadline is not None and time.monotonic() >= deadline
+            if pending and (size >= self.MAX_CONTENT or due or flushing or stopping):
+                self._send(pending)
+                pending, size, deadline = [], 0, None
+            with self._cond:
+                if flushing:
+                    self._flush_done = flush_to
+                    self._cond.notify_all()
+            if stopping:
+                return
+
+    def _pack(self, messages):
+        # 改行区切りで2000文字以内のメッセージに詰める（長いレコードは分割）
+        if self.dropped:
+            messages = [f"[WARNING] ログ{self.dropped}件を破棄しました"] + messages
+            self.dropped = 0
+        contents, current = [], ""
+        for msg in messages:
+            for i in range(0, len(msg), self.MAX_CONTENT):
+                piece = msg[i : i + self.MAX_CONTENT]
+                if current and len(current) + 1 + len(piece) > self.MAX_CONTENT:
+                    contents.append(current)
+                    current = ""
+                current = f"{current}\n{piece}" if current else piece
+        if current:
+            contents.append(current)
+        return contents
+
+    def _send(self, messages):
+        for content in self._pack(messages):
+            try:
+                response = discord_request(
+                    "POST",
                     self.webhook_url,
-                    data=json.dumps(data),
+                    data=json.dumps({"content": content}),
                     headers={"Content-Type": "application/json"},
-                    timeout=10,
                 )
                 # デバッグ用：レスポンスステータスをチェック
                 if response.status_code not in (200, 204):
                     print(
                         f"Discord webhook failed: {response.status_code} {response.text}"
                     )
-        except Exception as e:
-            # ログ送信失敗時はコンソールに出力（デバッグ用）
-            print(f"Discord webhook error: {e}")
+            except Exception as e:
+                # ログ送信失敗時はコンソールに出力（デバッグ用）
+                print(f"Discord webhook error: {e}")
 
 
 # カスタムロガーを作成（Flaskのloggerと分離）
@@ -195,7 +442,22 @@ class MaxLevelFilter(logging.Filter):
         return record.levelno <= self.max_level
 
 
-_formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s")
+def guild_tag():
+    # 複数ギルドを並行処理するとき、どのギルドのログ・通知か分かるように付ける
+    guild = _current_guild.get()
+    return f"[{guild.label}] " if MULTI_GUILD and guild else ""
+
+
+class GuildTagFilter(logging.Filter):
+    def filter(self, record):
+        record.guild = guild_tag()
+        return True
+
+
+logger.addFilter(GuildTagFilter())
+_formatter = logging.Formatter(
+    "%(asctime)s %(levelname)s %(name)s %(guild)s%(message)s"
+)
 
 # 既存のハンドラーをクリア（重複防止）
 logger.handlers.clear()
@@ -212,7 +474,11 @@ stderr_handler.setFormatter(_formatter)
 logger.addHandler(stderr_handler)
 
 if DISCORD_LOG_WEBHOOK_URL:
-    _discord = DiscordWebhookHandler(DISCORD_LOG_WEBHOOK_URL)
+    _discord = DiscordWebhookHandler(
+        DISCORD_LOG_WEBHOOK_URL,
+        max_queue=int(os.getenv("DISCORD_LOG_QUEUE_SIZE", "1000")),
+        flush_interval=float(os.getenv("DISCORD_LOG_FLUSH_INTERVAL", "2")),
+    )
     # INFOレベル以上をDiscordに送信（成功メッセージも含める）
     DISCORD_LOG_LEVEL = os.getenv("DISCORD_LOG_LEVEL", "INFO").upper()
     _discord.setLevel(getattr(logging, DISCORD_LOG_LEVEL, logging.INFO))
@@ -220,152 +486,1675 @@ if DISCORD_LOG_WEBHOOK_URL:
     logger.addHandler(_discord)
 
 
-def get_channel_list():
-    url = f"https://discord.com/api/v10/guilds/{GUILD_ID}/channels"
-    headers = {"Authorization": f"Bot {DISCORD_TOKEN}"}
-    r = requests.get(url, headers=headers)
-    r.raise_for_status()
-    return [
-        ch for ch in r.json()
-        if ch["type"] == 0 and ch["id"] not in EXCLUDED_CHANNEL_IDS
-    ]
+_STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    channel_id TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (channel_id, message_id)
+);
+-- ストアが (low_message_id, last_message_id] の範囲を欠けなく保持していることを示す
+CREATE TABLE IF NOT EXISTS watermarks (
+    channel_id TEXT PRIMARY KEY,
+    low_message_id INTEGER NOT NULL,
+    last_message_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS summary_cache (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    text TEXT NOT NULL,
+    total_tokens INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    parent_id TEXT NOT NULL,
+    archived INTEGER NOT NULL,
+    archived_at REAL,
+    payload TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+-- チャンネルごとの公開アーカイブ走査の実行時刻（次回はここまで遡れば十分）
+CREATE TABLE IF NOT EXISTS thread_scans (
+    channel_id TEXT PRIMARY KEY,
+    scanned_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS model_health (
+    model TEXT PRIMARY KEY,
+    consecutive_failures INTEGER NOT NULL,
+    open_until REAL NOT NULL,
+    successes INTEGER NOT NULL,
+    failures INTEGER NOT NULL,
+    total_latency REAL NOT NULL,
+    last_error TEXT,
+    updated_at REAL NOT NULL
+);
+-- 投稿済みWebhookメッセージ（再実行時に同じものを再投稿しないため）
+CREATE TABLE IF NOT EXISTS webhook_posts (
+    run_key TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    message_id TEXT,
+    posted_at REAL NOT NULL,
+    PRIMARY KEY (run_key, idx)
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    guild_id TEXT,
+    status TEXT NOT NULL,
+    stage TEXT,
+    window_end TEXT NOT NULL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_checkpoints (
+    job_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    output TEXT NOT NULL,
+    finished_at REAL NOT NULL,
+    PRIMARY KEY (job_id, stage)
+);
+-- ギルドのメンバー・チャンネル・ロールの表示名（kind: member / channel / role）
+CREATE TABLE IF NOT EXISTS guild_directory (
+    guild_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (guild_id, kind, id)
+);
+CREATE TABLE IF NOT EXISTS guild_directory_fetches (
+    guild_id TEXT PRIMARY KEY,
+    fetched_at REAL NOT NULL
+);
+-- 日次サマリー（day はサマリー対象日 YYYY-MM-DD、JST）
+CREATE TABLE IF NOT EXISTS daily_summaries (
+    guild_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (guild_id, day)
+);
+-- 実行中・直近完了の実行（lease_key: ギルド×対象日、status: running / done）
+CREATE TABLE IF NOT EXISTS leases (
+    lease_key TEXT PRIMARY KEY,
+    job_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+-- 実行ごとの計測レコード（RunMetrics.to_record() のJSON）
+CREATE TABLE IF NOT EXISTS run_metrics (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    record TEXT NOT NULL
+);
+"""
+# 既存の state.db に後から追加した列 (table, column, type)
+_STATE_MIGRATIONS = [("jobs", "guild_id", "TEXT"), ("jobs", "post_key", "TEXT")]
+_state_ready = False
 
 
-def get_channel_messages(channel_id, since_dt, *, kind="channel", name=None):
-    url = f"https://discord.com/api/v10/channels/{channel_id}/messages"
-    headers = {"Authorization": f"Bot {DISCORD_TOKEN}"}
-    params = {"limit": 100}
-    r = requests.get(url, headers=headers, params=params)
-    logger.info(f"{kind.title()}: {name or channel_id}, Status: {r.status_code}")
-    if r.status_code == 403:
-        logger.warning("  → 権限なし")
-        return None
-    if r.status_code != 200:
-        logger.error(f"  → エラー: {r.text}")
-        _log_error_to_discord(
-            "❌ get_channel_messages:",
-            f"{kind}={name or channel_id} status={r.status_code} body={r.text[:200]}",
+@contextlib.contextmanager
+def _state_db():
+    global _state_ready
+    os.makedirs(STATE_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(STATE_DIR, "state.db"), timeout=30)
+    try:
+        if not _state_ready:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_STATE_SCHEMA)
+            for table, column, decl in _STATE_MIGRATIONS:
+                columns = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+            _state_ready = True
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _load_watermark(channel_id):
+    with _state_db() as db:
+        return db.execute(
+            "SELECT low_message_id, last_message_id FROM watermarks"
+            " WHERE channel_id = ?",
+            (channel_id,),
+        ).fetchone()
+
+
+def _store_messages(channel_id, messages, low, high):
+    with _state_db() as db:
+        db.executemany(
+            "INSERT OR REPLACE INTO messages (channel_id, message_id, payload)"
+            " VALUES (?, ?, ?)",
+            [(channel_id, int(m["id"]), json.dumps(m)) for m in messages],
         )
-        return None
-    messages = r.json()
-    filtered = []
-    for msg in messages:
-        msg_dt = datetime.datetime.fromisoformat(
-            msg["timestamp"].replace("Z", "+00:00")
+        db.execute(
+            "INSERT OR REPLACE INTO watermarks"
+            " (channel_id, low_message_id, last_message_id) VALUES (?, ?, ?)",
+            (channel_id, low, high),
+        )
+
+
+def _load_stored_messages(channel_id, after, before=None):
+    with _state_db() as db:
+        rows = db.execute(
+            "SELECT payload FROM messages WHERE channel_id = ?"
+            " AND message_id > ? AND message_id < ? ORDER BY message_id",
+            (channel_id, after, before if before is not None else (1 << 63) - 1),
+        ).fetchall()
+    return [json.loads(r[0]) for r in rows]
+
+
+def compact_message_store():
+    # 保持期間より古いメッセージを削除し、カバー範囲の下端を繰り上げる
+    cutoff = datetime_to_snowflake(
+        datetime.datetime.now(JST)
+        - datetime.timedelta(days=MESSAGE_STORE_RETENTION_DAYS)
+    )
+    with _state_db() as db:
+        deleted = db.execute(
+            "DELETE FROM messages WHERE message_id <= ?", (cutoff,)
+        ).rowcount
+        db.execute("DELETE FROM watermarks WHERE last_message_id <= ?", (cutoff,))
+        db.execute(
+            "DELETE FROM threads WHERE updated_at < ?",
+            (time.time() - MESSAGE_STORE_RETENTION_DAYS * 86400,),
+        )
+        db.execute(
+            "DELETE FROM webhook_posts WHERE posted_at < ?",
+            (time.time() - MESSAGE_STORE_RETENTION_DAYS * 86400,),
+        )
+        db.execute(
+            "DELETE FROM daily_summaries WHERE day < ?",
+            (
+                (
+                    datetime.datetime.now(JST)
+                    - datetime.timedelta(days=DAILY_SUMMARY_RETENTION_DAYS)
+                )
+                .date()
+                .isoformat(),
+            ),
+        )
+        db.execute("DELETE FROM leases WHERE expires_at < ?", (time.time(),))
+        db.execute(
+            "UPDATE watermarks SET low_message_id = ? WHERE low_message_id < ?",
+            (cutoff, cutoff),
+        )
+    if deleted:
+        with _state_db() as db:
+            db.execute("PRAGMA incremental_vacuum")
+        logger.info(f"message store: {deleted}件の古いメッセージを削除")
+    _prune_snapshots()
+
+
+def _prune_snapshots():
+    # 保持期間を過ぎたスナップショットを消す
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return
+    cutoff = time.time() - SNAPSHOT_RETENTION_DAYS * 86400
+    for name in os.listdir(SNAPSHOT_DIR):
+        path = os.path.join(SNAPSHOT_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+class RateLimitScheduler:
+    # DiscordのX-RateLimit-*ヘッダーからバケットごとの残り枠とリセット時刻を追跡し、
+    # 制限に達する前に待機する。asyncio側と同期側の両方から使うためロックで保護する。
+    _MAJOR_RE = re.compile(r"/(channels|guilds|webhooks)/(\d+)")
+
+    def __init__(self, headroom=1, global_per_sec=50):
+        self.headroom = headroom
+        self.global_per_sec = global_per_sec
+        self._lock = threading.Lock()
+        self._route_buckets = {}  # route -> X-RateLimit-Bucket
+        self._buckets = {}  # bucket:major -> {"limit", "remaining", "reset_at"}
+        self._global_until = 0.0
+        self._recent = collections.deque()  # 直近1秒の送信時刻
+
+    def _key(self, route):
+        m = self._MAJOR_RE.search(route)
+        major = m.group(0) if m else ""
+        return f"{self._route_buckets.get(route, route)}:{major}"
+
+    def reserve(self, route):
+        # 送信してよければ枠を1つ消費して0を返す。待つ必要があれば待ち秒数を返す
+        with self._lock:
+            now = time.monotonic()
+            wait = self._global_until - now
+            while self._recent and self._recent[0] <= now - 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= max(1, self.global_per_sec - self.headroom):
+                wait = max(wait, self._recent[0] + 1.0 - now)
+            bucket = self._buckets.get(self._key(route))
+            if bucket:
+                if now >= bucket["reset_at"]:
+                    bucket["remaining"] = bucket["limit"]
+                elif bucket["remaining"] <= self.headroom:
+                    wait = max(wait, bucket["reset_at"] - now)
+            if wait > 0:
+                return wait
+            if bucket:
+                bucket["remaining"] -= 1
+            self._recent.append(now)
+            return 0.0
+
+    def update(self, route, status, headers, body=""):
+        # レスポンスヘッダーで状態を更新する。429の場合は待つべき秒数を返す
+        with self._lock:
+            now = time.monotonic()
+            bucket_id = headers.get("X-RateLimit-Bucket")
+            if bucket_id:
+                self._route_buckets[route] = bucket_id
+            limit = headers.get("X-RateLimit-Limit")
+            remaining = headers.get("X-RateLimit-Remaining")
+            reset_after = headers.get("X-RateLimit-Reset-After")
+            if limit is not None and remaining is not None and reset_after:
+                self._buckets[self._key(route)] = {
+                    "limit": int(limit),
+                    "remaining": int(remaining),
+                    "reset_at": now + float(reset_after),
+                }
+            if status != 429:
+                return 0.0
+
+            try:
+                data = json.loads(body) if body else {}
+            except ValueError:
+                data = {}
+            retry_after = float(
+                data.get("retry_after") or headers.get("Retry-After") or 1.0
+            )
+            if data.get("global") or headers.get("X-RateLimit-Global"):
+                self._global_until = max(self._global_until, now + retry_after)
+            else:
+                bucket = self._buckets.setdefault(
+                    self._key(route), {"limit": 1, "remaining": 0, "reset_at": 0.0}
+                )
+                bucket["remaining"] = 0
+                bucket["reset_at"] = now + retry_after
+            return retry_after
+
+
+# プロセス内の全Discordリクエストで共有する
+rate_limiter = RateLimitScheduler(RATE_LIMIT_HEADROOM, RATE_LIMIT_GLOBAL_PER_SEC)
+
+
+class RunMetrics:
+    # 1回の実行の計測値。HTTP呼び出しはエンドポイントごと、Gemini呼び出しは
+    # モデルごとに集計し、終了時に1件のJSONレコードとして保存・ログ出力する。
+    # 要約のワーカースレッドからも書き込むためロックで保護する
+    _WEBHOOK_RE = re.compile(r"/webhooks/\d+/[^/]+")
+    _ID_RE = re.compile(r"/\d+")
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.guild_id = current_guild().guild_id
+        self.status = "running"
+        self.started_at = time.time()
+        self.model_used = None
+        self.summary_cache = None
+        self.summary_plan = None
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._endpoints = {}
+        self._models = {}
+
+    @classmethod
+    def endpoint(cls, route):
+        # IDとWebhookトークンを伏せ、同じ種類の呼び出しをまとめる
+        route = cls._WEBHOOK_RE.sub("/webhooks/{id}/{token}", route)
+        return cls._ID_RE.sub("/{id}", route)
+
+    def _endpoint(self, route):
+        return self._endpoints.setdefault(
+            self.endpoint(route),
+            {
+                "requests": 0,
+                "retries": 0,
+                "errors": 0,
+                "seconds": 0.0,
+                "bytes_in": 0,
+                "bytes_out": 0,
+                "rate_limit_wait_seconds": 0.0,
+            },
+        )
+
+    def http(self, route, status, seconds, bytes_out=0, bytes_in=0):
+        # status=None は通信エラー。429は再送として数える
+        with self._lock:
+            ep = self._endpoint(route)
+            ep["requests"] += 1
+            ep["seconds"] += seconds
+            ep["bytes_out"] += bytes_out
+            ep["bytes_in"] += bytes_in
+            if status == 429:
+                ep["retries"] += 1
+            elif status is None or status >= 400:
+                ep["errors"] += 1
+
+    def retry(self, route):
+        with self._lock:
+            self._endpoint(route)["retries"] += 1
+
+    def rate_limit_wait(self, route, seconds):
+        with self._lock:
+            self._endpoint(route)["rate_limit_wait_seconds"] += seconds
+
+    def model_call(self, name, ok, seconds, usage=None, bytes_out=0, bytes_in=0):
+        with self._lock:
+            m = self._models.setdefault(
+                name,
+                {
+                    "calls": 0,
+                    "failures": 0,
+                    "seconds": 0.0,
+                    "prompt_tokens": 0,
+                    "output_tokens": 0,
+                    "bytes_in": 0,
+                    "bytes_out": 0,
+                },
+            )
+            m["calls"] += 1
+            m["failures"] += int(not ok)
+            m["seconds"] += seconds
+            m["prompt_tokens"] += getattr(usage, "prompt_token_count", None) or 0
+            m["output_tokens"] += getattr(usage, "candidates_token_count", None) or 0
+            m["bytes_out"] += bytes_out
+            m["bytes_in"] += bytes_in
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._stages[name] = {"seconds": time.monotonic() - started}
+
+    def resumed_stage(self, name):
+        self._stages[name] = {"seconds": 0.0, "resumed": True}
+
+    def to_record(self):
+        with self._lock:
+            endpoints = {
+                k: {**v, "seconds": round(v["seconds"], 3)}
+                for k, v in sorted(self._endpoints.items())
+            }
+            for v in endpoints.values():
+                v["rate_limit_wait_seconds"] = round(v["rate_limit_wait_seconds"], 3)
+            models = {
+                k: {**v, "seconds": round(v["seconds"], 3)}
+                for k, v in self._models.items()
+            }
+        stages = {
+            k: {**v, "seconds": round(v["seconds"], 3)} for k, v in self._stages.items()
+        }
+
+        def total(items, key):
+            return sum(v[key] for v in items.values())
+
+        return {
+            "job_id": self.job_id,
+            "guild_id": self.guild_id,
+            "status": self.status,
+            "started_at": datetime.datetime.fromtimestamp(
+                self.started_at, JST
+            ).isoformat(),
+            "duration_seconds": round(time.monotonic() - self._started, 3),
+            "stages": stages,
+            "http": {
+                "requests": total(endpoints, "requests"),
+                "retries": total(endpoints, "retries"),
+                "errors": total(endpoints, "errors"),
+                "bytes_in": total(endpoints, "bytes_in"),
+                "bytes_out": total(endpoints, "bytes_out"),
+                "rate_limit_wait_seconds": round(
+                    total(endpoints, "rate_limit_wait_seconds"), 3
+                ),
+                "endpoints": endpoints,
+            },
+            "gemini": {
+                "model_used": self.model_used,
+                "calls": total(models, "calls"),
+                "prompt_tokens": total(models, "prompt_tokens"),
+                "output_tokens": total(models, "output_tokens"),
+                "models": models,
+                "summary_cache": self.summary_cache,
+                "summary_plan": self.summary_plan,
+            },
+        }
+
+
+# 実行中のジョブの RunMetrics（ワーカースレッドには copy_context() で引き継ぐ）
+_current_run = contextvars.ContextVar("current_run", default=None)
+
+
+def _body_size(data):
+    if not data:
+        return 0
+    return len(data.encode("utf-8") if isinstance(data, str) else data)
+
+
+def save_run_metrics(metrics):
+    record = metrics.to_record()
+    with _state_db() as db:
+        db.execute(
+            "INSERT INTO run_metrics (job_id, started_at, record) VALUES (?, ?, ?)",
+            (
+                metrics.job_id,
+                metrics.started_at,
+                json.dumps(record, ensure_ascii=False),
+            ),
         )
-        if msg_dt > since_dt:
-            filtered.append(msg)
-    logger.info(f"  → {len(filtered)}件のメッセージを取得")
-    return filtered
+        db.execute(
+            "DELETE FROM run_metrics WHERE id NOT IN"
+            " (SELECT id FROM run_metrics ORDER BY id DESC LIMIT ?)",
+            (RUN_METRICS_HISTORY,),
+        )
+    return record
+
+
+def recent_run_metrics(limit=50):
+    with _state_db() as db:
+        rows = db.execute(
+            "SELECT record FROM run_metrics ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+    return [json.loads(r[0]) for r in rows]
+
+
+_http = None
+_http_lock = threading.Lock()
+
+
+def _http_session():
+    # Webhook・ログ送信用の requests.Session。接続をウォーム実行間で使い回す
+    global _http
+    with _http_lock:
+        if _http is None:
+            import requests
+
+            _http = requests.Session()
+    return _http
+
+
+def discord_request(method, url, **kwargs):
+    # 同期版（Webhook投稿用）。レート制限を守り、429はretry_after後に再送する
+    import requests
+
+    http = _http_session()
+    route = f"{method} {urlparse(url).path}"
+    metrics = _current_run.get()
+    kwargs.setdefault("timeout", DISCORD_TIMEOUT)
+    sent = _body_size(kwargs.get("data"))
+    for attempt in range(DISCORD_MAX_RETRIES + 1):
+        while (wait := rate_limiter.reserve(route)) > 0:
+            if metrics:
+                metrics.rate_limit_wait(route, wait)
+            time.sleep(wait)
+        started = time.monotonic()
+        try:
+            r = http.request(method, url, **kwargs)
+        except requests.RequestException:
+            if metrics:
+                metrics.http(route, None, time.monotonic() - started, sent)
+            raise
+        if metrics:
+            metrics.http(
+                route, r.status_code, time.monotonic() - started, sent, len(r.content)
+            )
+        retry_after = rate_limiter.update(route, r.status_code, r.headers, r.text)
+        # 429 以外、または最後の試行の後は待たない
+        if r.status_code != 429 or attempt == DISCORD_MAX_RETRIES:
+            break
+        if metrics:
+            metrics.rate_limit_wait(route, retry_after)
+        time.sleep(retry_after)
+    return r
+
+
+class DiscordLoop:
+    # Discord取得用のイベントループを専用スレッドで動かし続け、その上の aiohttp
+    # セッション（コネクションプール）をウォーム実行間・ギルド間で使い回す
+    def __init__(self):
+        self.session = None
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name="discord-loop", daemon=True
+                ).start()
+        return self._loop
+
+    def run(self, coro):
+        # 呼び出し元のコンテキスト（処理中のギルド・計測）のままループ上で実行し、
+        # 結果を待って返す
+        loop = self._ensure_loop()
+        done = concurrent.futures.Future()
+
+        def finish(task):
+            if task.cancelled():
+                done.cancel()
+            elif task.exception() is not None:
+                done.set_exception(task.exception())
+            else:
+                done.set_result(task.result())
+
+        def start():
+            loop.create_task(coro).add_done_callback(finish)
+
+        loop.call_soon_threadsafe(start, context=contextvars.copy_context())
+        return done.result()
+
+
+discord_loop = DiscordLoop()
+
+
+async def _discord_session():
+    # ループ上で1つだけ作り、閉じずに使い回す
+    import aiohttp
+
+    if discord_loop.session is None or discord_loop.session.closed:
+        discord_loop.session = aiohttp.ClientSession(
+            headers={"Authorization": f"Bot {DISCORD_TOKEN}"},
+            connector=aiohttp.TCPConnector(limit=COLLECT_CONCURRENCY),
+            timeout=aiohttp.ClientTimeout(total=DISCORD_TIMEOUT),
+        )
+    return discord_loop.session
+
+
+async def _discord_get(session, path, params=None):
+    import aiohttp
+
+    route = f"GET {path}"
+    metrics = _current_run.get()
+    for attempt in range(DISCORD_MAX_RETRIES + 1):
+        while (wait := rate_limiter.reserve(route)) > 0:
+            if metrics:
+                metrics.rate_limit_wait(route, wait)
+            await asyncio.sleep(wait)
+        started = time.monotonic()
+        try:
+            async with session.get(f"{DISCORD_API_BASE}{path}", params=params) as r:
+                raw = await r.read()
+                body = await r.text(errors="replace")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if metrics:
+                metrics.http(route, None, time.monotonic() - started)
+            # 使い回した接続が実行の合間に切れていることがあるので接続エラーは再送する
+            if (
+                isinstance(e, aiohttp.ClientConnectionError)
+                and attempt < DISCORD_MAX_RETRIES
+            ):
+                continue
+            raise
+        if metrics:
+            metrics.http(route, r.status, time.monotonic() - started, 0, len(raw))
+        retry_after = rate_limiter.update(route, r.status, r.headers, body)
+        if r.status != 429:
+            break
+        logger.warning(f"rate limited: {route} retry_after={retry_after:.2f}s")
+        # 最後の試行の後は待たない
+        if attempt == DISCORD_MAX_RETRIES:
+            break
+        if metrics:
+            metrics.rate_limit_wait(route, retry_after)
+        await asyncio.sleep(retry_after)
+    return r.status, body
+
+
+class DiscordAPIError(Exception):
+    def __init__(self, func, status, body):
+        super().__init__(f"{func}: status={status} body={body[:200]}")
+        self.status = status
+        self.body = body
+
+
+def _raise_for_status(func, status, body):
+    if status != 200:
+        raise DiscordAPIError(func, status, body)
+
+
+def datetime_to_snowflake(dt):
+    return (int(dt.timestamp() * 1000) - DISCORD_EPOCH_MS) << 22
+
+
+def snowflake_to_datetime(snowflake):
+    ms = (int(snowflake) >> 22) + DISCORD_EPOCH_MS
+    return datetime.datetime.fromtimestamp(ms / 1000, tz=datetime.timezone.utc)
+
+
+async def get_guild_channels(session):
+    # ギルドの全チャンネル（カテゴリ・ボイス等も含む）
+    guild = current_guild()
+    status, body = await _discord_get(session, f"/guilds/{guild.guild_id}/channels")
+    _raise_for_status("get_guild_channels", status, body)
+    return json.loads(body)
+
+
+def text_channels(channels):
+    # 収集対象のテキストチャンネル（除外チャンネルを除く）
+    excluded = current_guild().excluded_channel_ids
+    return [ch for ch in channels if ch["type"] == 0 and ch["id"] not in excluded]
+
+
+async def iter_channel_messages(
+    session, channel_id, since_dt, until_dt=None, *, after=None
+):
+    # 期間をスノーフレークに変換し、after カーソルで古い順にページングする。
+    # 各ページは古い順に並べて返し、期間の終端を越えた時点で止める。
+    if after is None:
+        after = datetime_to_snowflake(since_dt)
+    before = datetime_to_snowflake(until_dt) if until_dt else None
+    while True:
+        status, body = await _discord_get(
+            session,
+            f"/channels/{channel_id}/messages",
+            params={"limit": MESSAGES_PAGE_SIZE, "after": after},
+        )
+        _raise_for_status("get_channel_messages", status, body)
+        raw = json.loads(body)
+        page = sorted(raw, key=lambda m: int(m["id"]))
+        if before is not None:
+            page = [m for m in page if int(m["id"]) < before]
+        if page:
+            yield page
+        if len(raw) < MESSAGES_PAGE_SIZE or len(page) < len(raw):
+            return
+        after = page[-1]["id"]
+
+
+async def get_channel_messages(
+    session,
+    channel_id,
+    since_dt,
+    *,
+    until_dt=None,
+    kind="channel",
+    name=None,
+    last_message_id=None,
+):
+    # ストアが保持している範囲より新しい分だけ取得し、残りはストアから返す
+    since_sf = datetime_to_snowflake(since_dt)
+    until_sf = datetime_to_snowflake(until_dt) if until_dt else None
+    if last_message_id and int(last_message_id) <= since_sf:
+        logger.info(f"{kind.title()}: {name or channel_id}, 期間内の投稿なし")
+        return []
+
+    # state.db の読み書きはイベントループ（全ギルドで共有）を止めないよう別スレッドで行う
+    wm = await asyncio.to_thread(_load_watermark, channel_id)
+    if wm and wm[0] <= since_sf <= wm[1]:
+        low, start = wm
+    else:
+        low, start = since_sf, since_sf
+    up_to_date = (last_message_id and int(last_message_id) <= start) or (
+        until_sf is not None and until_sf <= start
+    )
+
+    fetched = 0
+    if not up_to_date:
+        high = start
+        try:
+            async for page in iter_channel_messages(
+                session, channel_id, since_dt, until_dt, after=start
+            ):
+                high = int(page[-1]["id"])
+                fetched += len(page)
+                await asyncio.to_thread(_store_messages, channel_id, page, low, high)
+        except DiscordAPIError as e:
+            logger.info(f"{kind.title()}: {name or channel_id}, Status: {e.status}")
+            if e.status == 403:
+                logger.warning("  → 権限なし")
+                return None
+            logger.error(f"  → エラー: {e.body}")
+            _log_error_to_discord(
+                "❌ get_channel_messages:",
+                f"{kind}={name or channel_id} status={e.status} body={e.body[:200]}",
+            )
+            return None
+        if not fetched:
+            await asyncio.to_thread(_store_messages, channel_id, [], low, high)
+
+    messages = await asyncio.to_thread(
+        _load_stored_messages, channel_id, since_sf, until_sf
+    )
+    logger.info(f"{kind.title()}: {name or channel_id}, Status: 200")
+    logger.info(f"  → {len(messages)}件のメッセージを取得（新規 {fetched}件）")
+    return messages
 
 
 # 追加: ギルド内のアクティブなスレッド一覧
-def get_active_threads():
-    url = f"https://discord.com/api/v10/guilds/{GUILD_ID}/threads/active"
-    headers = {"Authorization": f"Bot {DISCORD_TOKEN}"}
-    r = requests.get(url, headers=headers, timeout=15)
-    r.raise_for_status()
-    return r.json().get("threads", [])  # threads配列
-
-
-# 追加: チャンネルの公開アーカイブ済みスレッド（直近分）
-def get_public_archived_threads(channel_id, before=None):
-    url = f"https://discord.com/api/v10/channels/{channel_id}/threads/archived/public"
-    headers = {"Authorization": f"Bot {DISCORD_TOKEN}"}
-    params = {}
+async def get_active_threads(session):
+    status, body = await _discord_get(
+        session, f"/guilds/{current_guild().guild_id}/threads/active"
+    )
+    _raise_for_status("get_active_threads", status, body)
+    return json.loads(body).get("threads", [])  # threads配列
+
+
+# 追加: チャンネルの公開アーカイブ済みスレッド（アーカイブ時刻の新しい順）
+async def get_public_archived_threads(session, channel_id, before=None):
+    # (threads, has_more) を返す
+    params = {"limit": ARCHIVED_THREADS_PAGE_SIZE}
     if before:
         params["before"] = before  # ISO8601文字列
-    r = requests.get(url, headers=headers, params=params, timeout=15)
-    if r.status_code == 403:
-        return []
-    r.raise_for_status()
-    return r.json().get("threads", [])
+    status, body = await _discord_get(
+        session, f"/channels/{channel_id}/threads/archived/public", params=params
+    )
+    if status == 403:
+        return [], False
+    _raise_for_status("get_public_archived_threads", status, body)
+    data = json.loads(body)
+    return data.get("threads", []), data.get("has_more", False)
+
+
+def _parse_discord_ts(ts):
+    return datetime.datetime.fromisoformat(ts.replace("Z", "+00:00"))
+
+
+def _archived_at(thread):
+    arch_ts = thread.get("thread_metadata", {}).get("archive_timestamp")
+    return _parse_discord_ts(arch_ts).timestamp() if arch_ts else None
+
+
+# --- スレッドレジストリ（実行間でスレッドのメタデータを保持する） ---
+def register_threads(threads, *, archived):
+    now = time.time()
+    with _state_db() as db:
+        db.executemany(
+            "INSERT OR REPLACE INTO threads (thread_id, parent_id, archived,"
+            " archived_at, payload, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    t["id"],
+                    t.get("parent_id") or "",
+                    int(archived),
+                    _archived_at(t),
+                    json.dumps(t),
+                    now,
+                )
+                for t in threads
+            ],
+        )
+
+
+def registered_archived_threads(channel_id, since_dt):
+    # 期間内にアーカイブされたスレッド（新しい順）
+    with _state_db() as db:
+        rows = db.execute(
+            "SELECT payload FROM threads WHERE parent_id = ? AND archived = 1"
+            " AND archived_at >= ? ORDER BY archived_at DESC",
+            (channel_id, since_dt.timestamp()),
+        ).fetchall()
+    return [json.loads(r[0]) for r in rows]
 
 
-def build_all_text():
-    since_dt = datetime.datetime.now(JST) - datetime.timedelta(days=1)
-    all_text = ""
+def _last_thread_scan(channel_id):
+    with _state_db() as db:
+        row = db.execute(
+            "SELECT scanned_at FROM thread_scans WHERE channel_id = ?", (channel_id,)
+        ).fetchone()
+    return row[0] if row else None
 
-    active_threads = get_active_threads()  # 先に全アクティブ取得
+
+def _save_thread_scan(channel_id, scanned_at):
+    with _state_db() as db:
+        db.execute(
+            "INSERT OR REPLACE INTO thread_scans (channel_id, scanned_at)"
+            " VALUES (?, ?)",
+            (channel_id, scanned_at),
+        )
+
+
+async def discover_archived_threads(session, channel_id, since_dt):
+    # アーカイブ時刻の新しい順に before でページングし、期間の下端か
+    # 前回の走査時刻（それ以前のアーカイブはレジストリにある）を越えたら止める
+    scanned_at = time.time()
+    last_scan = await asyncio.to_thread(_last_thread_scan, channel_id)
+    stop_at = max(since_dt.timestamp(), last_scan or 0)
+    before = None
+    while True:
+        threads, has_more = await get_public_archived_threads(
+            session, channel_id, before
+        )
+        await asyncio.to_thread(register_threads, threads, archived=True)
+        if not threads or not has_more:
+            break
+        oldest = threads[-1].get("thread_metadata", {}).get("archive_timestamp")
+        if not oldest or _parse_discord_ts(oldest).timestamp() < stop_at:
+            break
+        before = oldest
+    await asyncio.to_thread(_save_thread_scan, channel_id, scanned_at)
+
+
+class GuildDirectory:
+    # ギルドのメンバー・チャンネル・ロールの ID → 表示名
+    _MENTION_RE = re.compile(r"<(@!?|@&|#)(\d+)>")
+
+    def __init__(self, members=None, channels=None, roles=None, fetched_at=0.0):
+        self.members = members or {}
+        self.channels = channels or {}
+        self.roles = roles or {}
+        self.fetched_at = fetched_at
+
+    @property
+    def fresh(self):
+        return time.time() - self.fetched_at < GUILD_DIRECTORY_TTL_HOURS * 3600
+
+    def mention_replacer(self, member_names):
+        # <@id> <@!id> <@&id> <#id> を1回の走査で表示名に置き換える関数を返す。
+        # 名前が分からないメンションはそのまま残す
+        def name_of(m):
+            kind, id_ = m.groups()
+            if kind == "#":
+                name = self.channels.get(id_)
+                return f"#{name}" if name else m.group(0)
+            if kind == "@&":
+                name = self.roles.get(id_)
+            else:
+                name = member_names.get(id_) or self.members.get(id_)
+            return f"@{name}" if name else m.group(0)
+
+        def replace(text):
+            return self._MENTION_RE.sub(name_of, text) if "<" in text else text
+
+        return replace
+
+
+_directories = {}  # guild_id -> GuildDirectory（ウォーム実行間で使い回す）
+_directories_lock = threading.Lock()
+
+
+def _member_display_name(member):
+    user = member.get("user") or {}
+    return member.get("nick") or user.get("global_name") or user.get("username")
+
+
+def _load_directory(guild_id):
+    with _state_db() as db:
+        row = db.execute(
+            "SELECT fetched_at FROM guild_directory_fetches WHERE guild_id = ?",
+            (guild_id,),
+        ).fetchone()
+        rows = db.execute(
+            "SELECT kind, id, name FROM guild_directory WHERE guild_id = ?",
+            (guild_id,),
+        ).fetchall()
+    directory = GuildDirectory(fetched_at=row[0] if row else 0.0)
+    tables = {
+        "member": directory.members,
+        "channel": directory.channels,
+        "role": directory.roles,
+    }
+    for kind, id_, name in rows:
+        tables[kind][id_] = name
+    return directory
+
+
+def _save_directory(guild_id, directory):
+    rows = [
+        (guild_id, kind, id_, name)
+        for kind, names in (
+            ("member", directory.members),
+            ("channel", directory.channels),
+            ("role", directory.roles),
+        )
+        for id_, name in names.items()
+    ]
+    with _state_db() as db:
+        db.execute("DELETE FROM guild_directory WHERE guild_id = ?", (guild_id,))
+        db.executemany(
+            "INSERT INTO guild_directory (guild_id, kind, id, name)"
+            " VALUES (?, ?, ?, ?)",
+            rows,
+        )
+        db.execute(
+            "INSERT OR REPLACE INTO guild_directory_fetches (guild_id, fetched_at)"
+            " VALUES (?, ?)",
+            (guild_id, directory.fetched_at),
+        )
+
+
+# スナップショット再生中は記録時の一覧を使う
+_directory_override = contextvars.ContextVar("directory_override", default=None)
+
+
+def guild_directory(guild=None):
+    # メモリ上 → state.db の順に引く（取得はしない。古くてもそのまま返す）
+    if _directory_override.get() is not None:
+        return _directory_override.get()
+    guild_id = (guild or current_guild()).guild_id
+    with _directories_lock:
+        directory = _directories.get(guild_id)
+        if directory is None:
+            directory = _directories[guild_id] = _load_directory(guild_id)
+    return directory
+
+
+async def _fetch_members(session, guild_id):
+    # after カーソルで全メンバーをページングする（要 Server Members Intent）
+    members, after = {}, "0"
+    while True:
+        status, body = await _discord_get(
+            session,
+            f"/guilds/{guild_id}/members",
+            {"limit": MEMBERS_PAGE_SIZE, "after": after},
+        )
+        _raise_for_status("get_guild_members", status, body)
+        page = json.loads(body)
+        for m in page:
+            name = _member_display_name(m)
+            if name:
+                members[m["user"]["id"]] = name
+        if len(page) < MEMBERS_PAGE_SIZE:
+            return members
+        after = page[-1]["user"]["id"]
+
+
+async def refresh_guild_directory(session, channels=None):
+    # TTL切れならメンバー・チャンネル・ロールをまとめて取り直す。失敗しても
+    # 要約は止めず、手元の（古い）一覧のまま続ける。channels には収集側で取得中の
+    # get_guild_channels のタスクを渡せる（同じ一覧を二重に取らないため）
+    guild = current_guild()
+    directory = await asyncio.to_thread(guild_directory, guild)
+    if directory.fresh:
+        return directory
+    guild_id = guild.guild_id
+    members, channel_list, roles_resp = await asyncio.gather(
+        _fetch_members(session, guild_id),
+        channels or get_guild_channels(session),
+        _discord_get(session, f"/guilds/{guild_id}/roles"),
+        return_exceptions=True,
+    )
+    if isinstance(members, Exception):
+        logger.warning(f"guild directory: members unavailable: {members}")
+        members = directory.members
+    channels, roles = directory.channels, directory.roles
+    if not isinstance(channel_list, Exception):
+        channels = {c["id"]: c["name"] for c in channel_list if c.get("name")}
+    if not isinstance(roles_resp, Exception) and roles_resp[0] == 200:
+        roles = {r["id"]: r["name"] for r in json.loads(roles_resp[1])}
+    refreshed = GuildDirectory(members, channels, roles, time.time())
+    try:
+        await asyncio.to_thread(_save_directory, guild_id, refreshed)
+    except sqlite3.Error as e:
+        logger.warning(f"guild directory: save failed: {e}")
+    with _directories_lock:
+        _directories[guild_id] = refreshed
+    logger.info(
+        f"guild directory: members={len(members)} channels={len(channels)}"
+        f" roles={len(roles)}"
+    )
+    return refreshed
+
+
+async def _collect_threads(session, threads, since_dt, until_dt=None):
+    results = await asyncio.gather(
+        *(
+            get_channel_messages(
+                session,
+                t["id"],
+                since_dt,
+                until_dt=until_dt,
+                kind="thread",
+                name=t.get("name", "(no title)"),
+                last_message_id=t.get("last_message_id"),
+            )
+            for t in threads
+        )
+    )
+    return list(zip(threads, results))
+
+
+async def _collect_channel(session, ch, active_threads, since_dt, until_dt=None):
+    # 本体・アクティブスレッド・アーカイブ走査を同時に行い、その後で
+    # レジストリから期間内にアーカイブされたスレッドを取り出して取得する。
+    # 期間内に投稿のないスレッドは last_message_id で判定され取得されない
+    messages, active, _ = await asyncio.gather(
+        get_channel_messages(
+            session,
+            ch["id"],
+            since_dt,
+            until_dt=until_dt,
+            kind="channel",
+            name=ch["name"],
+            last_message_id=ch.get("last_message_id"),
+        ),
+        _collect_threads(session, active_threads, since_dt, until_dt),
+        discover_archived_threads(session, ch["id"], since_dt),
+    )
+    active_ids = {t["id"] for t in active_threads}
+    registered = await asyncio.to_thread(
+        registered_archived_threads, ch["id"], since_dt
+    )
+    archived = [t for t in registered if t["id"] not in active_ids]
+    return (
+        messages,
+        active,
+        await _collect_threads(session, archived, since_dt, until_dt),
+    )
+
+
+async def _collect_all(since_dt, until_dt=None):
+    session = await _discord_session()
+    # チャンネル一覧は収集と名前一覧の更新の両方で使うので1回だけ取る
+    guild_channels = asyncio.ensure_future(get_guild_channels(session))
+    # 名前一覧（メンバーの全ページ・ロール）は組み立て時まで要らないので、
+    # 取り直す場合も収集を待たせずに並行して進める
+    directory_refresh = asyncio.ensure_future(
+        refresh_guild_directory(session, guild_channels)
+    )
+    active_threads, all_channels = await asyncio.gather(
+        get_active_threads(session), guild_channels
+    )
+    channels = text_channels(all_channels)
+    await asyncio.to_thread(register_threads, active_threads, archived=False)
     threads_by_parent = {}
     for t in active_threads:
         pid = t.get("parent_id")
         if pid:
             threads_by_parent.setdefault(pid, []).append(t)
 
-    for ch in get_channel_list():
-        logger.info(f"--- チャンネル: #{ch['name']} ---")
-        # 本体メッセージ
-        messages = get_channel_messages(
-            ch["id"], since_dt, kind="channel", name=ch["name"]
-        )
-        if messages is None:
-            logger.info("  → スキップ")
-        else:
-            all_text += f"\n\n--- チャンネル: #{ch['name']} ---\n"
-            if not messages:
-                all_text += "投稿なし\n"
-            else:
-                for msg in reversed(messages):
-                    dt = datetime.datetime.fromisoformat(
-                        msg["timestamp"].replace("Z", "+00:00")
-                    ).astimezone(JST)
-                    name = resolve_member_name(msg["author"])
-                    all_text += f"{dt.strftime('%H:%M')} {name}: {msg['content']}\n"
-
-        # スレッド（アクティブ）
-        for t in threads_by_parent.get(ch["id"], []):
-            all_text += f"\n--- スレッド: {t.get('name','(no title)')} ---\n"
-            t_msgs = get_channel_messages(
-                t["id"], since_dt, kind="thread", name=t.get("name", "(no title)")
-            )
-            if not t_msgs:
-                all_text += "投稿なし\n"
-            else:
-                for msg in reversed(t_msgs):
-                    dt = datetime.datetime.fromisoformat(
-                        msg["timestamp"].replace("Z", "+00:00")
-                    ).astimezone(JST)
-                    name = resolve_member_name(msg["author"])
-                    all_text += f"{dt.strftime('%H:%M')} {name}: {msg['content']}\n"
-
-        # スレッド（公開アーカイブの直近分も拾う・必要に応じて）
-        archived = get_public_archived_threads(ch["id"])
-        for t in archived:
-            # 直近24hに関わるものだけ
-            meta = t.get("thread_metadata", {})
-            arch_ts = meta.get("archive_timestamp")
-            if arch_ts:
-                arch_dt = datetime.datetime.fromisoformat(
-                    arch_ts.replace("Z", "+00:00")
+    results, directory = await asyncio.gather(
+        asyncio.gather(
+            *(
+                _collect_channel(
+                    session,
+                    ch,
+                    threads_by_parent.get(ch["id"], []),
+                    since_dt,
+                    until_dt,
                 )
-                if arch_dt < since_dt:
-                    continue
-            all_text += (
-                f"\n--- スレッド(アーカイブ): {t.get('name','(no title)')} ---\n"
+                for ch in channels
             )
-            t_msgs = get_channel_messages(
-                t["id"], since_dt, kind="thread", name=t.get("name", "(no title)")
+        ),
+        directory_refresh,
+    )
+    # スレッドへのメンションも名前にできるよう、今回見えたスレッド名を足しておく
+    directory.channels.update({t["id"]: t["name"] for t in active_threads})
+    return list(zip(channels, results))
+
+
+# メンションはそのまま残し、それ以外の数字・URLを可変部分とみなす
+_NOISE_VARIABLE_RE = re.compile(r"<[@#][!&]?\d+>|https?://\S+|\d+")
+
+
+def _noise_variables(content):
+    return [v for v in _NOISE_VARIABLE_RE.findall(content) if not v.startswith("<")]
+
+
+def _is_automated(msg):
+    # Bot・Webhook（cron通知など）の投稿
+    return bool(msg["author"].get("bot") or msg.get("webhook_id"))
+
+
+def _noise_key(msg):
+    # 可変部分を伏せて空白を詰めた本文のハッシュ（投稿者ごと）
+    text = _NOISE_VARIABLE_RE.sub(
+        lambda m: m.group(0) if m.group(0).startswith("<") else "0", msg["content"]
+    )
+    text = " ".join(text.split()).lower()
+    digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    return (msg["author"].get("id"), digest)
+
+
+class TranscriptEntry:
+    # 履歴テキストの1行。定型投稿をまとめた行は last_at（最後の投稿時刻）・
+    # count（件数）・note（可変部分の値）を持つ
+    __slots__ = ("at", "author", "content", "last_at", "count", "note")
+
+    def __init__(self, at, author, content, last_at=None, count=1, note=""):
+        self.at = at
+        self.author = author
+        self.content = content
+        self.last_at = last_at
+        self.count = count
+        self.note = note
+
+    def write(self, out):
+        # "HH:MM 名前: 本文" / "HH:MM–HH:MM 名前: 本文 ×件数（値: ...）"
+        at = self.at
+        if self.count > 1:
+            last = self.last_at
+            out.write(
+                f"{at.hour:02d}:{at.minute:02d}–{last.hour:02d}:{last.minute:02d}"
+                f" {self.author}: {self.content} ×{self.count}{self.note}\n"
             )
-            if not t_msgs:
-                all_text += "投稿なし\n"
-            else:
-                for msg in reversed(t_msgs):
-                    dt = datetime.datetime.fromisoformat(
-                        msg["timestamp"].replace("Z", "+00:00")
-                    ).astimezone(JST)
-                    name = resolve_member_name(msg["author"])
-                    all_text += f"{dt.strftime('%H:%M')} {name}: {msg['content']}\n"
+        else:
+            out.write(f"{at.hour:02d}:{at.minute:02d} {self.author}: {self.content}\n")
+
+    def to_dict(self):
+        last_at = self.last_at.isoformat() if self.last_at else None
+        return [
+            self.at.isoformat(),
+            self.author,
+            self.content,
+            last_at,
+            self.count,
+            self.note,
+        ]
+
+    @classmethod
+    def from_dict(cls, data):
+        at, author, content, last_at, count, note = data
+        return cls(
+            datetime.datetime.fromisoformat(at),
+            author,
+            content,
+            datetime.datetime.fromisoformat(last_at) if last_at else None,
+            count,
+            note,
+        )
 
-    return all_text
 
+class TranscriptSection:
+    # チャンネル本体またはスレッド1つ分。kind: channel / thread / archived
+    __slots__ = ("kind", "name", "channel", "entries")
+    HEADERS = {
+        "channel": "\n\n--- チャンネル: #{} ---\n",
+        "thread": "\n--- スレッド: {} ---\n",
+        "archived": "\n--- スレッド(アーカイブ): {} ---\n",
+    }
+
+    def __init__(self, kind, name, channel, entries):
+        self.kind = kind
+        self.name = name
+        self.channel = channel  # 親チャンネル名（channel なら自身）
+        self.entries = entries
+
+    @property
+    def label(self):
+        return f"#{self.name}" if self.kind == "channel" else self.name
+
+    @property
+    def header(self):
+        return self.HEADERS[self.kind].format(self.name).strip("\n")
+
+    def write(self, out):
+        out.write(self.HEADERS[self.kind].format(self.name))
+        if not self.entries:
+            out.write("投稿なし\n")
+        for entry in self.entries:
+            entry.write(out)
+
+    def render(self):
+        out = io.StringIO()
+        self.write(out)
+        return out.getvalue()
+
+    def to_dict(self):
+        return {
+            "kind": self.kind,
+            "name": self.name,
+            "channel": self.channel,
+            "entries": [entry.to_dict() for entry in self.entries],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        entries = [TranscriptEntry.from_dict(e) for e in data["entries"]]
+        return cls(data["kind"], data["name"], data["channel"], entries)
+
+
+class Transcript:
+    # 収集結果を構造のまま持つ履歴。テキストは render() で一度に書き出す。
+    # チェックポイントには to_dict() の形で残す
+    __slots__ = ("sections",)
+
+    def __init__(self, sections=None):
+        self.sections = sections or []
+
+    @property
+    def post_count(self):
+        # 定型投稿をまとめた行は件数分を数える
+        return sum(e.count for section in self.sections for e in section.entries)
+
+    def write(self, out):
+        for section in self.sections:
+            section.write(out)
+
+    def render(self):
+        out = io.StringIO()
+        self.write(out)
+        return out.getvalue()
+
+    def to_dict(self):
+        return [section.to_dict() for section in self.sections]
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls([TranscriptSection.from_dict(d) for d in data])
+
+
+def _message_time(msg):
+    return datetime.datetime.fromisoformat(
+        msg["timestamp"].replace("Z", "+00:00")
+    ).astimezone(JST)
+
+
+def _render_entries(entries):
+    out = io.StringIO()
+    for entry in entries:
+        entry.write(out)
+    return out.getvalue()
+
+
+def transcript_entries(messages, replace_mentions, noise_stats=None, section=""):
+    # メッセージを TranscriptEntry にする（時刻の解析は1件1回）。Bot・Webhookの
+    # 定型・ほぼ同一の投稿が NOISE_MIN_REPEATS 件以上続いていれば、時間幅と件数付きの
+    # 1行にまとめる（間に別の投稿を挟むものはまとめず、会話の順序を崩さない）
+    plain = [
+        TranscriptEntry(
+            _message_time(msg),
+            resolve_member_name(msg["author"]),
+            replace_mentions(msg["content"]),
+        )
+        for msg in messages
+    ]
+    if not NOISE_REDUCTION:
+        return plain
+
+    keys = [_noise_key(msg) if _is_automated(msg) else None for msg in messages]
+    entries = []
+    i = 0
+    while i < len(messages):
+        end = i + 1
+        while keys[i] and end < len(messages) and keys[end] == keys[i]:
+            end += 1
+        if end - i < NOISE_MIN_REPEATS:
+            entries.extend(plain[i:end])
+            i = end
+            continue
+        # 数字・URLなど可変部分が違う場合は、値を失わないよう併記する
+        variants = []
+        for j in range(i, end):
+            v = ",".join(_noise_variables(messages[j]["content"]))
+            if v not in variants:
+                variants.append(v)
+        note = ""
+        if len(variants) > 1:
+            more = " 他" if len(variants) > 10 else ""
+            note = f"（値: {' / '.join(variants[:10])}{more}）"
+        first = plain[i]
+        entries.append(
+            TranscriptEntry(
+                first.at, first.author, first.content, plain[end - 1].at, end - i, note
+            )
+        )
+        i = end
+    if len(entries) == len(plain):
+        return plain
+    if noise_stats is not None:
+        before, after = _render_entries(plain), _render_entries(entries)
+        saved_chars = len(before) - len(after)
+        saved_tokens = estimate_tokens(before) - estimate_tokens(after)
+        total = noise_stats.setdefault(section, [0, 0])
+        total[0] += saved_chars
+        total[1] += saved_tokens
+        logger.info(
+            f"noise reduction: {section} -{saved_chars}字（~{saved_tokens} tokens）"
+        )
+    return entries
 
-def generate_summary(all_text):
-    # 新SDK: google-genai を使用（APIキーは環境変数 GEMINI_API_KEY から自動取得）
-    client = genai.Client()
-    model_candidates = ["gemini-2.5-pro", "gemini-1.5-flash"]
 
-    prompt = f"""【タスク】
+def collect_transcript(since_dt=None, until_dt=None, *, record_to=None):
+    # [since_dt, until_dt) の履歴を Transcript にする（until_dt 省略時は現在まで）。
+    # record_to を渡すと、収集したデータをそのパスにスナップショットとして残す
+    if since_dt is None:
+        since_dt = datetime.datetime.now(JST) - datetime.timedelta(days=1)
+    compact_message_store()
+
+    # 取得は並列、組み立てはチャンネル順・スレッド順で逐次（出力順を固定するため）
+    collected = discord_loop.run(_collect_all(since_dt, until_dt))
+    if record_to:
+        try:
+            write_snapshot(record_to, collected, since_dt, until_dt)
+        except OSError as e:
+            logger.warning(f"snapshot: 書き込みに失敗: {e}")
+    return build_transcript(collected)
+
+
+def build_transcript(collected):
+    # _collect_all の結果（またはスナップショットから復元したもの）を Transcript にする。
+    # 権限のないチャンネル本体は載せない（配下のスレッドは載せる）
+    replace_mentions = guild_directory().mention_replacer(current_guild().member_names)
+    noise_stats = {}
+    sections = []
+
+    def add(kind, name, channel, messages):
+        section = TranscriptSection(kind, name, channel, [])
+        section.entries = transcript_entries(
+            messages or [], replace_mentions, noise_stats, section.label
+        )
+        sections.append(section)
+
+    for ch, (messages, active, archived) in collected:
+        logger.info(f"--- チャンネル: #{ch['name']} ---")
+        if messages is None:
+            logger.info("  → スキップ")
+        else:
+            add("channel", ch["name"], ch["name"], messages)
+        # スレッド（アクティブ、公開アーカイブの直近分）
+        for kind, threads in (("thread", active), ("archived", archived)):
+            for t, t_msgs in threads:
+                add(kind, t.get("name", "(no title)"), ch["name"], t_msgs)
+
+    if noise_stats:
+        saved_chars = sum(v[0] for v in noise_stats.values())
+        saved_tokens = sum(v[1] for v in noise_stats.values())
+        logger.info(f"noise reduction: 合計 -{saved_chars}字（~{saved_tokens} tokens）")
+    return Transcript(sections)
+
+
+# --- スナップショット（収集データの記録と再生） ---
+# ファイル構成: MAGIC | ブロック... | 索引 | 索引の位置(8バイト) | MAGIC
+# ブロックは1チャンネル（スレッド）分のメッセージ最大 SNAPSHOT_BLOCK_MESSAGES 件を
+# JSON Lines にして zlib で圧縮したもの。索引にはブロックごとのチャンネルIDと
+# メッセージIDの範囲・位置を持つので、mmap した上で必要なブロックだけ展開できる
+SNAPSHOT_MAGIC = b"TSBSNAP1"
+SNAPSHOT_BLOCK_MESSAGES = 500
+
+
+def snapshot_path(job_id):
+    name = f"{current_guild().guild_id}-{job_id}.snap"
+    return os.path.join(SNAPSHOT_DIR, name)
+
+
+def _thread_entries(threads):
+    return [{"thread": t, "forbidden": msgs is None} for t, msgs in threads]
+
+
+def write_snapshot(path, collected, since_dt, until_dt=None):
+    directory = guild_directory()
+    guild = current_guild()
+    blocks = []
+    tmp_path = path + ".tmp"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+
+        def write_block(payload):
+            data = zlib.compress(payload, 6)
+            offset = f.tell()
+            f.write(data)
+            return offset, len(data)
+
+        def write_messages(channel_id, messages):
+            for i in range(0, len(messages or []), SNAPSHOT_BLOCK_MESSAGES):
+                chunk = messages[i : i + SNAPSHOT_BLOCK_MESSAGES]
+                offset, length = write_block(
+                    "".join(
+                        json.dumps(m, ensure_ascii=False) + "\n" for m in chunk
+                    ).encode("utf-8")
+                )
+                blocks.append(
+                    {
+                        "channel_id": channel_id,
+                        "first_id": int(chunk[0]["id"]),
+                        "last_id": int(chunk[-1]["id"]),
+                        "offset": offset,
+                        "length": length,
+                        "count": len(chunk),
+                    }
+                )
+
+        channels = []
+        for ch, (messages, active, archived) in collected:
+            write_messages(ch["id"], messages)
+            for t, msgs in active + archived:
+                write_messages(t["id"], msgs)
+            channels.append(
+                {
+                    "channel": ch,
+                    "forbidden": messages is None,
+                    "active": _thread_entries(active),
+                    "archived": _thread_entries(archived),
+                }
+            )
+        meta = {
+            "channels": channels,
+            "member_overrides": guild.member_names,
+            "directory": {
+                "members": directory.members,
+                "channels": directory.channels,
+                "roles": directory.roles,
+            },
+        }
+        meta_offset, meta_length = write_block(
+            json.dumps(meta, ensure_ascii=False).encode("utf-8")
+        )
+        index = {
+            "version": 1,
+            "guild_id": guild.guild_id,
+            "since": since_dt.isoformat(),
+            "until": (until_dt or datetime.datetime.now(JST)).isoformat(),
+            "recorded_at": datetime.datetime.now(JST).isoformat(),
+            "meta": [meta_offset, meta_length],
+            "blocks": blocks,
+        }
+        index_offset, _ = write_block(json.dumps(index).encode("utf-8"))
+        f.write(struct.pack("<Q", index_offset))
+        f.write(SNAPSHOT_MAGIC)
+    os.replace(tmp_path, path)
+    logger.info(f"snapshot: {path} blocks={len(blocks)} bytes={os.path.getsize(path)}")
+    return path
+
+
+class Snapshot:
+    # スナップショットの読み出し。ファイルは mmap し、索引で選んだブロックだけを
+    # 展開するので、長期間のスナップショットでも一部の期間を少ないメモリで読める
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # 空ファイル
+            self._file.close()
+            raise ValueError(f"snapshot: {path} is empty")
+        tail = len(self._mm) - len(SNAPSHOT_MAGIC)
+        if (
+            self._mm[: len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC
+            or self._mm[tail:] != SNAPSHOT_MAGIC
+        ):
+            self.close()
+            raise ValueError(f"snapshot: {path} is not a snapshot file")
+        (index_offset,) = struct.unpack("<Q", self._mm[tail - 8 : tail])
+        self.index = json.loads(zlib.decompress(self._mm[index_offset : tail - 8]))
+        self._blocks = {}
+        for block in self.index["blocks"]:
+            self._blocks.setdefault(block["channel_id"], []).append(block)
+        self._meta = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    @property
+    def since(self):
+        return datetime.datetime.fromisoformat(self.index["since"])
+
+    @property
+    def until(self):
+        return datetime.datetime.fromisoformat(self.index["until"])
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            offset, length = self.index["meta"]
+            self._meta = json.loads(zlib.decompress(self._mm[offset : offset + length]))
+        return self._meta
+
+    def iter_messages(self, channel_id, since_dt=None, until_dt=None):
+        # [since_dt, until_dt) のメッセージを古い順に返す。範囲外のブロックは展開しない
+        low = datetime_to_snowflake(since_dt) if since_dt else 0
+        high = datetime_to_snowflake(until_dt) if until_dt else 1 << 64
+        for block in self._blocks.get(channel_id, []):
+            if block["last_id"] < low or block["first_id"] >= high:
+                continue
+            data = self._mm[block["offset"] : block["offset"] + block["length"]]
+            for line in zlib.decompress(data).splitlines():
+                msg = json.loads(line)
+                if low <= int(msg["id"]) < high:
+                    yield msg
+
+    def collected(self, since_dt=None, until_dt=None):
+        # _collect_all と同じ形に復元する（権限のなかったチャンネル・スレッドは None）
+        def load(channel_id, forbidden):
+            if forbidden:
+                return None
+            return list(self.iter_messages(channel_id, since_dt, until_dt))
+
+        result = []
+        for entry in self.meta["channels"]:
+            ch = entry["channel"]
+            result.append(
+                (
+                    ch,
+                    (
+                        load(ch["id"], entry["forbidden"]),
+                        [
+                            (t["thread"], load(t["thread"]["id"], t["forbidden"]))
+                            for t in entry["active"]
+                        ],
+                        [
+                            (t["thread"], load(t["thread"]["id"], t["forbidden"]))
+                            for t in entry["archived"]
+                        ],
+                    ),
+                )
+            )
+        return result
+
+
+def replay_snapshot(path, since_dt=None, until_dt=None, *, summarize=True):
+    # Discordにはアクセスせず、記録時の名前解決のままトランスクリプトを作り直す。
+    # summarize=True なら要約まで行う（投稿はしない）。(履歴テキスト, summary) を返す
+    with Snapshot(path) as snap:
+        meta = snap.meta
+        guild = GuildConfig(snap.index["guild_id"], None)
+        guild.member_names = meta["member_overrides"]
+        directory = GuildDirectory(
+            meta["directory"]["members"],
+            meta["directory"]["channels"],
+            meta["directory"]["roles"],
+            fetched_at=time.time(),
+        )
+        guild_token = _current_guild.set(guild)
+        directory_token = _directory_override.set(directory)
+        try:
+            transcript = build_transcript(snap.collected(since_dt, until_dt))
+        finally:
+            _directory_override.reset(directory_token)
+            _current_guild.reset(guild_token)
+    all_text = transcript.render()
+    logger.info(f"snapshot replay: {path} text length={len(all_text)}")
+    return all_text, generate_summary(transcript) if summarize else None
+
+
+MODEL_CANDIDATES = ["gemini-2.5-pro", "gemini-1.5-flash"]
+# モデルごとのタイムアウト（秒）。GEMINI_MODEL_TIMEOUTS='{"gemini-2.5-pro": 240}' で個別指定
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "180"))
+GEMINI_MODEL_TIMEOUTS = json.loads(os.getenv("GEMINI_MODEL_TIMEOUTS", "{}"))
+# 0より大きければ、先頭モデルがこの秒数で応答しないとき次のモデルを並行実行する
+SUMMARY_HEDGE_AFTER_SECONDS = float(os.getenv("SUMMARY_HEDGE_AFTER_SECONDS", "0"))
+# モデルごとの出力トークン上限（プランの出力枠がこれを超える場合は切り詰める）
+MODEL_MAX_OUTPUT_TOKENS = {"gemini-1.5-flash": 8192}
+# プロンプトのトークン数に応じたモデルの優先順と出力枠。max_prompt_tokens の小さい順に
+# 見て最初に収まる段を使う（null は上限なし）。SUMMARY_TIERS='[...]' で差し替え可
+SUMMARY_TIERS = json.loads(
+    os.getenv(
+        "SUMMARY_TIERS",
+        json.dumps(
+            [
+                {
+                    "name": "light",
+                    "max_prompt_tokens": 4000,
+                    "models": ["gemini-1.5-flash", "gemini-2.5-pro"],
+                    "max_output_tokens": 2048,
+                },
+                {
+                    "name": "standard",
+                    "max_prompt_tokens": 60000,
+                    "models": ["gemini-2.5-pro", "gemini-1.5-flash"],
+                    "max_output_tokens": 10000,
+                },
+                {
+                    "name": "large",
+                    "max_prompt_tokens": None,
+                    "models": ["gemini-2.5-pro", "gemini-1.5-flash"],
+                    "max_output_tokens": 16000,
+                },
+            ]
+        ),
+    )
+)
+# 投稿がこの件数以下の日はAIを呼ばず、投稿の一覧（なければ「投稿なし」）を投稿する
+SUMMARY_SKIP_MAX_POSTS = int(os.getenv("SUMMARY_SKIP_MAX_POSTS", "2"))
+# 0: トークン数をAPIで数えず estimate_tokens の概算で段を選ぶ
+SUMMARY_COUNT_TOKENS = os.getenv("SUMMARY_COUNT_TOKENS", "1") == "1"
+# 全ギルド・全ワーカーで共有するGemini呼び出しの同時実行枠
+gemini_slots = threading.BoundedSemaphore(max(1, GEMINI_CONCURRENCY))
+
+_gemini = None
+_gemini_lock = threading.Lock()
+
+
+def gemini_client():
+    # 初回利用時に google-genai を読み込み、クライアントはウォーム実行間で使い回す
+    # （APIキーは環境変数 GEMINI_API_KEY から自動取得）
+    global _gemini
+    with _gemini_lock:
+        if _gemini is None:
+            from google import genai
+
+            _gemini = genai.Client()
+    return _gemini
+
+
+# 連続失敗（空応答を含む）がこの回数に達したモデルは CIRCUIT_OPEN_HOURS の間スキップ
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "2"))
+CIRCUIT_OPEN_HOURS = float(os.getenv("CIRCUIT_OPEN_HOURS", "12"))
+
+# auto: 推定トークン数が SUMMARY_SINGLE_MAX_TOKENS を超えたら map-reduce
+# single: 常に1プロンプト / mapreduce: 常に分割要約
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "auto").lower()
+SUMMARY_SINGLE_MAX_TOKENS = int(os.getenv("SUMMARY_SINGLE_MAX_TOKENS", "60000"))
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "20000"))
+SUMMARY_MAP_WORKERS = int(os.getenv("SUMMARY_MAP_WORKERS", "4"))
+# 1: 最終要約をストリーミング生成し、できたメッセージから順に投稿する
+SUMMARY_STREAMING = os.getenv("SUMMARY_STREAMING", "0") == "1"
+# 生成結果キャッシュ（0でキャッシュ無効）
+SUMMARY_CACHE_TTL_HOURS = float(os.getenv("SUMMARY_CACHE_TTL_HOURS", "48"))
+SUMMARY_CACHE_MAX_BYTES = int(
+    os.getenv("SUMMARY_CACHE_MAX_BYTES", str(20 * 1024 * 1024))
+)
+
+SOURCE_LABEL_RAW = "【実際のチャット履歴】"
+SOURCE_LABEL_PARTIAL = (
+    "【チャンネル別の部分要約】\n"
+    "（チャット履歴を分割して要約したものです。これを統合してサマリーを作成してください）"
+)
+
+SUMMARY_PROMPT = """【タスク】
 チャット履歴を確認し、社内での出来事・動きの全体像を把握するための日次サマリーを作成してください。
 
 【カバレッジ要件】
@@ -405,20 +2194,270 @@ Discordのusername／global_name／nickは出力に用いないでください
 引用が必要な場合は、スクリーンショット・Discordメッセージリンク・原文引用なども適宜利用してください。
 
 ---
-【実際のチャット履歴】
+{source_label}
+{all_text}
+---
+"""
+
+MAP_PROMPT = """【タスク】
+以下はDiscordのチャット履歴の一部です。後で他の部分と統合して日次サマリーを作るための部分要約を作成してください。
+
+【要件】
+チャンネル・スレッドごとに見出し（例：#チャンネル名、スレッド名）を付け、時刻・投稿者・主旨を箇条書きで簡潔にまとめてください。
+どのチャンネル・スレッドも省略しないでください。投稿がない場合は「投稿なし」と書いてください。
+議論が長い場合は要点に絞り、決定事項・依頼・期限・数値は必ず残してください。
+投稿者名は入力ログの表記をそのまま使ってください。
+前置きや感想、フィードバックは不要です。
+
+---
+【チャット履歴（一部）】
 {all_text}
 ---
 """
-    last_err = None
-    for name in model_candidates:
+
+
+def estimate_tokens(text):
+    # 概算: ASCIIは約4文字で1トークン、日本語などそれ以外は約1文字で1トークン
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return ascii_chars // 4 + (len(text) - ascii_chars)
+
+
+def _channel_blocks(transcript):
+    # 親チャンネルごとに、チャンネル本体とその配下のスレッドをまとめる（出力順のまま）
+    blocks = []
+    for section in transcript.sections:
+        if blocks and blocks[-1][0].channel == section.channel:
+            blocks[-1].append(section)
+        else:
+            blocks.append([section])
+    return blocks
+
+
+def _split_block(sections, max_tokens):
+    # 1チャンネル分が予算を超える場合は行単位で分け、見出しを繰り返す
+    block = "".join(section.render() for section in sections).strip("\n")
+    if estimate_tokens(block) <= max_tokens:
+        return [block]
+    header = sections[0].header if sections[0].kind == "channel" else ""
+    pieces, current, size = [], [], 0
+    for n, section in enumerate(sections):
+        text = section.render().rstrip("\n")
+        # 分割位置が属するスレッドの見出し（新しいスレッドの見出しは繰り返さない）
+        thread_header = ""
+        for line in (text.lstrip("\n") if n == 0 else text).split("\n"):
+            cost = estimate_tokens(line) + 1
+            if current and size + cost > max_tokens:
+                pieces.append("\n".join(current))
+                current = [f"{h}（続き）" for h in (header, thread_header) if h]
+                size = 0
+            if section.kind != "channel" and line == section.header:
+                thread_header = line
+            current.append(line)
+            size += cost
+    if current:
+        pieces.append("\n".join(current))
+    return pieces
+
+
+def split_transcript(transcript, max_tokens):
+    # チャンネル（とその配下のスレッド）単位でまとめ、トークン予算内に詰める
+    chunks, current, size = [], [], 0
+    for sections in _channel_blocks(transcript):
+        for piece in _split_block(sections, max_tokens):
+            cost = estimate_tokens(piece)
+            if current and size + cost > max_tokens:
+                chunks.append("\n\n".join(current))
+                current, size = [], 0
+            current.append(piece)
+            size += cost
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+class SummaryCacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit, tokens=0):
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self.saved_tokens += tokens
+            else:
+                self.misses += 1
+
+    def __str__(self):
+        return f"hits={self.hits} misses={self.misses} saved_tokens={self.saved_tokens}"
+
+
+def summary_cache_key(model, config, prompt):
+    # プロンプト（テンプレート＋履歴）・モデル名・生成設定のハッシュ
+    payload = json.dumps(
+        {"model": model, "config": config, "prompt": prompt},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _summary_cache_get(key):
+    if SUMMARY_CACHE_TTL_HOURS <= 0:
+        return None
+    now = time.time()
+    with _state_db() as db:
+        row = db.execute(
+            "SELECT model, text, total_tokens FROM summary_cache"
+            " WHERE key = ? AND created_at > ?",
+            (key, now - SUMMARY_CACHE_TTL_HOURS * 3600),
+        ).fetchone()
+        if row:
+            db.execute(
+                "UPDATE summary_cache SET last_used_at = ? WHERE key = ?", (now, key)
+            )
+    return row
+
+
+def _summary_cache_put(key, model, text, total_tokens):
+    if SUMMARY_CACHE_TTL_HOURS <= 0:
+        return
+    now = time.time()
+    size = len(text.encode("utf-8"))
+    with _state_db() as db:
+        db.execute(
+            "INSERT OR REPLACE INTO summary_cache"
+            " (key, model, text, total_tokens, size, created_at, last_used_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, model, text, total_tokens, size, now, now),
+        )
+        # 期限切れを削除し、容量超過分は最終利用が古い順に追い出す
+        db.execute(
+            "DELETE FROM summary_cache WHERE created_at <= ?",
+            (now - SUMMARY_CACHE_TTL_HOURS * 3600,),
+        )
+        total = db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM summary_cache"
+        ).fetchone()[0]
+        if total > SUMMARY_CACHE_MAX_BYTES:
+            for old_key, old_size in db.execute(
+                "SELECT key, size FROM summary_cache ORDER BY last_used_at"
+            ).fetchall():
+                if total <= SUMMARY_CACHE_MAX_BYTES:
+                    break
+                db.execute("DELETE FROM summary_cache WHERE key = ?", (old_key,))
+                total -= old_size
+
+
+def _model_timeout(name):
+    return float(GEMINI_MODEL_TIMEOUTS.get(name, GEMINI_TIMEOUT_SECONDS))
+
+
+def _record_model_result(name, ok, latency, error=None):
+    # サーキットブレーカー: 連続失敗が閾値に達したら一定時間そのモデルを使わない
+    now = time.time()
+    with _state_db() as db:
+        row = db.execute(
+            "SELECT consecutive_failures FROM model_health WHERE model = ?", (name,)
+        ).fetchone()
+        failures = 0 if ok else (row[0] if row else 0) + 1
+        open_until = (
+            now + CIRCUIT_OPEN_HOURS * 3600
+            if failures >= CIRCUIT_FAILURE_THRESHOLD
+            else 0
+        )
+        db.execute(
+            "INSERT INTO model_health (model, consecutive_failures, open_until,"
+            " successes, failures, total_latency, last_error, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(model) DO UPDATE SET"
+            " consecutive_failures = excluded.consecutive_failures,"
+            " open_until = excluded.open_until,"
+            " successes = successes + excluded.successes,"
+            " failures = failures + excluded.failures,"
+            " total_latency = total_latency + excluded.total_latency,"
+            " last_error = COALESCE(excluded.last_error, last_error),"
+            " updated_at = excluded.updated_at",
+            (name, failures, open_until, int(ok), int(not ok), latency, error, now),
+        )
+    if open_until:
+        logger.warning(
+            f"generate_summary: circuit open for {name} ({failures} failures)"
+        )
+
+
+def model_health():
+    with _state_db() as db:
+        rows = db.execute(
+            "SELECT model, consecutive_failures, open_until, successes, failures,"
+            " total_latency, last_error FROM model_health ORDER BY model"
+        ).fetchall()
+    health = {}
+    for model, consecutive, open_until, ok, ng, latency, last_error in rows:
+        calls = ok + ng
+        health[model] = {
+            "circuit_open": open_until > time.time(),
+            "consecutive_failures": consecutive,
+            "success_rate": round(ok / calls, 3) if calls else None,
+            "avg_latency": round(latency / calls, 2) if calls else None,
+            "calls": calls,
+            "last_error": last_error,
+        }
+    return health
+
+
+def _available_models(models=None):
+    # ブレーカーが開いているモデルを除く（全滅ならすべて試す）
+    models = models or MODEL_CANDIDATES
+    now = time.time()
+    with _state_db() as db:
+        opened = {
+            r[0]
+            for r in db.execute(
+                "SELECT model FROM model_health WHERE open_until > ?", (now,)
+            )
+        }
+    available = [m for m in models if m not in opened]
+    if opened:
+        logger.info(f"generate_summary: skipping models with open circuit {opened}")
+    return available or list(models)
+
+
+def _record_model_call(name, ok, latency, usage=None, prompt="", text=""):
+    metrics = _current_run.get()
+    if metrics:
+        metrics.model_call(
+            name, ok, latency, usage, _body_size(prompt), _body_size(text)
+        )
+
+
+def _model_config(name, config):
+    # モデルの出力上限を超える max_output_tokens を切り詰める
+    limit = MODEL_MAX_OUTPUT_TOKENS.get(name)
+    if limit and config.get("max_output_tokens", 0) > limit:
+        return {**config, "max_output_tokens": limit}
+    return config
+
+
+def _call_model(client, name, prompt, config, label):
+    from google.genai import types
+
+    # 1モデル分の呼び出し。(text, usage) を返し、失敗・空応答は (None, None)
+    # GEMINI_CONCURRENCY の枠が空くまで待ってから呼び出す（待ち時間は計測に含めない）
+    with gemini_slots:
+        started = time.monotonic()
         try:
-            logger.info(f"generate_summary: trying model={name}")
+            logger.info(f"generate_summary[{label}]: trying model={name}")
             resp = client.models.generate_content(
                 model=name,
                 contents=prompt,
                 config=types.GenerateContentConfig(
-                    max_output_tokens=10000,
-                    temperature=0.2,
+                    **_model_config(name, config),
+                    http_options=types.HttpOptions(
+                        timeout=int(_model_timeout(name) * 1000)
+                    ),
                 ),
             )
             text = getattr(resp, "text", None)
@@ -432,52 +2471,647 @@ Discordのusername／global_name／nickは出力に用いないでください
                 except Exception as e2:
                     logger.warning(f"generate_summary: extract parts failed: {e2}")
                     text = ""
+            latency = time.monotonic() - started
+            usage = getattr(resp, "usage_metadata", None)
+            _record_model_call(name, bool(text), latency, usage, prompt, text)
             if text:
-                try:
-                    usage = getattr(resp, "usage_metadata", None)
-                    post_discord_log_direct(f"🧠 model_used={name} usage={usage}")
-                except Exception as e_log:
-                    logger.warning(f"generate_summary: model log failed: {e_log}")
-                return text
-            else:
-                fr = None
-                try:
-                    fr = getattr((resp.candidates or [None])[0], "finish_reason", None)
-                except Exception:
-                    pass
-                logger.warning(
-                    f"generate_summary: empty text from {name}, finishReason={fr}"
-                )
+                _record_model_result(name, True, latency)
+                logger.info(f"generate_summary[{label}]: {name} ok in {latency:.1f}s")
+                return text, usage
+            fr = None
+            try:
+                fr = getattr((resp.candidates or [None])[0], "finish_reason", None)
+            except Exception:
+                pass
+            logger.warning(
+                f"generate_summary[{label}]: empty text from {name}, finishReason={fr}"
+            )
+            _record_model_result(name, False, latency, f"empty finishReason={fr}")
         except Exception as e:
-            logger.error(f"generate_summary: {name} failed: {e}")
+            logger.error(f"generate_summary[{label}]: {name} failed: {e}")
             _log_error_to_discord("❌ generate_summary:", f"{name} failed: {e}")
-            last_err = e
+            latency = time.monotonic() - started
+            _record_model_call(name, False, latency, prompt=prompt)
+            _record_model_result(name, False, latency, str(e)[:500])
+    return None, None
+
+
+def _call_models_hedged(client, models, prompt, config, label):
+    # 先頭モデルが SUMMARY_HEDGE_AFTER_SECONDS 以内に終わらなければ次のモデルも
+    # 並行して開始し、最初に得られた有効な応答を採用する
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=len(models))
+    waiting = list(models)
+    running = {}
+
+    def start(name):
+        future = pool.submit(
+            contextvars.copy_context().run,
+            _call_model,
+            client,
+            name,
+            prompt,
+            config,
+            label,
+        )
+        running[future] = name
+
+    try:
+        while waiting or running:
+            if waiting and not running:
+                start(waiting.pop(0))
+            done, _ = concurrent.futures.wait(
+                running,
+                timeout=SUMMARY_HEDGE_AFTER_SECONDS if waiting else None,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            if not done:
+                logger.info(f"generate_summary[{label}]: hedging with {waiting[0]}")
+                start(waiting.pop(0))
+                continue
+            for future in done:
+                name = running.pop(future)
+                text, usage = future.result()
+                if text:
+                    return text, name, usage
+        return None, None, None
+    finally:
+        # 負けた呼び出しはタイムアウトで終わるので待たない
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _generate_text(
+    client,
+    prompt,
+    *,
+    max_output_tokens=10000,
+    label="summary",
+    cache_stats=None,
+    models=None,
+):
+    # models（省略時は MODEL_CANDIDATES）を順に試し、(text, model, usage) を返す。
+    # 全滅なら (None, None, None)
+    config = {"max_output_tokens": max_output_tokens, "temperature": 0.2}
+    cached = _cached_text(prompt, config, label, cache_stats, models)
+    if cached:
+        return cached
+
+    models = _available_models(models)
+    if SUMMARY_HEDGE_AFTER_SECONDS > 0 and len(models) > 1:
+        text, name, usage = _call_models_hedged(client, models, prompt, config, label)
+    else:
+        text = name = usage = None
+        for name in models:
+            text, usage = _call_model(client, name, prompt, config, label)
+            if text:
+                break
+    if not text:
+        return None, None, None
+    _summary_cache_put(
+        summary_cache_key(name, config, prompt),
+        name,
+        text,
+        getattr(usage, "total_token_count", None) or 0,
+    )
+    return text, name, usage
+
+
+def _cached_text(prompt, config, label, cache_stats=None, models=None):
+    # 候補モデルの順にキャッシュを引き、ヒットすれば (text, model, None) を返す
+    for name in models or MODEL_CANDIDATES:
+        cached = _summary_cache_get(summary_cache_key(name, config, prompt))
+        if cached:
+            logger.info(f"generate_summary[{label}]: cache hit model={name}")
+            if cache_stats:
+                cache_stats.record(True, cached[2])
+            return cached[1], cached[0], None
+    if cache_stats:
+        cache_stats.record(False)
+    return None
+
+
+class ProgressivePoster:
+    # 生成中のテキストを溜め、Webhook 1メッセージ分がセクション（#チャンネル見出し）
+    # 単位で完成したものから順に投稿する。途中で失敗しても、投稿済みのセクションが
+    # 分かるので続きだけを投稿できる。
+    LIMIT = EMBED_TOTAL_LIMIT
+
+    def __init__(self, header="", run_key=None):
+        self.header = header
+        self.run_key = run_key  # 再投稿時に送信済みのメッセージを飛ばすためのキー
+        self.ok = True
+        self.posted = []
+        self._buffer = header
+        self._done = []  # 投稿し終えたセクションの見出し
+        self._cut_heading = None  # 1セクションが長すぎて途中で切った見出し
+        self._cut_lines = 0  # 途中で切ったセクションの、見出しを除く投稿済みの行数
+        self._in_cut = False  # バッファの先頭が途中で切ったセクションの続きか
+
+    def checkpoint(self):
+        # 投稿済みの内容（post ステージで続きを投稿し直すためにチェックポイントに残す）
+        return {
+            "posted": self.posted,
+            "done": self._done,
+            "cut_heading": self._cut_heading,
+            "cut_lines": self._cut_lines,
+            "in_cut": self._in_cut,
+        }
+
+    def restore(self, state):
+        self.posted = list(state["posted"])
+        self._cut_heading = state["cut_heading"]
+        self._cut_lines = state.get("cut_lines", 0)
+        self._in_cut = state.get("in_cut", self._cut_heading is not None)
+        self._done = state.get("done")
+        if self._done is None:
+            # 見出ししか残していなかった以前のチェックポイント
+            lines = "\n".join(self.posted).split("\n")
+            self._done = [
+                line.strip()
+                for line in lines
+                if _SUMMARY_HEADING_RE.match(line) and line.strip() != self._cut_heading
+            ]
+
+    def feed(self, text):
+        self._buffer += text
+        self._drain(final=False)
+
+    def finish(self):
+        self._drain(final=True)
+
+    def reset(self):
+        # 何も投稿していなければ、溜めていた生成途中のテキストを捨てる
+        if not self.posted:
+            self._buffer = self.header
+
+    def resume_with(self, text):
+        # 別経路で得た全文のうち、未投稿のセクションだけを投稿する
+        if not self.posted:
+            self._buffer = self.header + text
+            self.finish()
+            return
+        # 途中で切ったセクションは、投稿済みの行数の続きから送る
+        remainder = []
+        in_cut = False
+        for section in split_summary_sections(text):
+            heading = section.split("\n", 1)[0].strip()
+            if heading == self._cut_heading:
+                rest = section.split("\n")[1 + self._cut_lines :]
+                if "".join(rest).strip():
+                    in_cut = not remainder
+                    remainder.append(f"{heading}（続き）\n" + "\n".join(rest))
+            elif heading not in self._done:
+                remainder.append(section)
+        if in_cut:
+            # 付け直した見出し行は元のセクションの行数に数えない
+            self._in_cut = True
+            self._cut_lines -= 1
+        else:
+            self._in_cut = False
+            if self._cut_heading is not None:
+                self._done.append(self._cut_heading)
+                self._cut_heading = None
+        self._buffer = "".join(remainder)
+        self.finish()
+
+    def _drain(self, final):
+        while self._buffer.strip():
+            if (
+                self._in_cut
+                and _SUMMARY_HEADING_RE.match(self._buffer)
+                and not self._buffer.startswith(f"{self._cut_heading}（続き）\n")
+            ):
+                # 途中で切ったセクションは切れ目でちょうど終わっていた
+                self._done.append(self._cut_heading)
+                self._cut_heading = None
+                self._in_cut = False
+            sections = split_summary_sections(self._buffer)
+            complete = sections if final else sections[:-1]
+            size = count = 0
+            for section in complete:
+                if size + len(section) > self.LIMIT:
+                    break
+                size += len(section)
+                count += 1
+            if count == 0 and (complete or len(self._buffer) > self.LIMIT):
+                # 1セクションだけで上限を超える: 行の切れ目で分割する
+                cut = self._buffer.rfind("\n", 0, self.LIMIT) + 1 or self.LIMIT
+                piece = self._buffer[:cut]
+                if not self._post(piece):
+                    return
+                if self._in_cut:
+                    self._cut_lines += piece.count("\n")
+                else:
+                    self._cut_heading = sections[0].split("\n", 1)[0].strip()
+                    self._cut_lines = piece.count("\n") - 1
+                    self._in_cut = True
+                self._buffer = self._buffer[cut:]
+                continue
+            if count == len(complete) and not final:
+                if not complete or size + len(sections[-1]) <= self.LIMIT:
+                    return  # まだ1メッセージ分に満たない
+            if count == 0:
+                return
+            if not self._post(self._buffer[:size]):
+                return
+            for section in complete[:count]:
+                if self._in_cut:
+                    self._done.append(self._cut_heading)
+                    self._cut_heading = None
+                    self._in_cut = False
+                else:
+                    self._done.append(section.split("\n", 1)[0].strip())
+            self._buffer = self._buffer[size:]
+
+    def _post(self, content):
+        # 1件でも失敗したら以降は投稿しない（順序を保ち、続きは resume_with で送る）
+        content = content.strip("\n")
+        if not self.ok:
+            return False
+        if not content:
+            return True
+        run_key = self.run_key and f"{self.run_key}:stream:{len(self.posted)}"
+        if not post_to_discord(content, run_key=run_key):
+            self.ok = False
+            return False
+        self.posted.append(content)
+        return True
+
+
+def _map_chunks(client, chunks, cache_stats=None):
+    def summarize_chunk(i, chunk):
+        text, name, usage = _generate_text(
+            client,
+            MAP_PROMPT.format(all_text=chunk),
+            max_output_tokens=4000,
+            label=f"map {i + 1}/{len(chunks)}",
+            cache_stats=cache_stats,
+        )
+        if not text:
+            # 部分要約に失敗したチャンクは原文の先頭を渡して reduce 側に任せる
+            logger.warning(f"generate_summary: map {i + 1} failed; passing raw text")
+            return "（部分要約に失敗したため原文の一部）\n" + chunk[:2000]
+        logger.info(f"generate_summary[map {i + 1}]: model={name} usage={usage}")
+        return text
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, SUMMARY_MAP_WORKERS)
+    ) as pool:
+        futures = [
+            pool.submit(contextvars.copy_context().run, summarize_chunk, i, chunk)
+            for i, chunk in enumerate(chunks)
+        ]
+        return [f.result() for f in futures]
+
+
+def _stream_text(client, prompt, poster, label, config, models=None):
+    from google.genai import types
+
+    # ストリーミングで生成しながら poster に流す。途中まで投稿した後に失敗した
+    # 場合は、別モデルで最初から流し直すと重複するためそこで打ち切る
+    for name in _available_models(models):
+        with gemini_slots:
+            started = time.monotonic()
+            parts = []
+            usage = None
+            try:
+                logger.info(f"generate_summary[{label}]: streaming model={name}")
+                for chunk in client.models.generate_content_stream(
+                    model=name,
+                    contents=prompt,
+                    config=types.GenerateContentConfig(
+                        **_model_config(name, config),
+                        http_options=types.HttpOptions(
+                            timeout=int(_model_timeout(name) * 1000)
+                        ),
+                    ),
+                ):
+                    piece = getattr(chunk, "text", None) or ""
+                    usage = getattr(chunk, "usage_metadata", None) or usage
+                    if piece:
+                        parts.append(piece)
+                        poster.feed(piece)
+                text = "".join(parts).strip()
+                latency = time.monotonic() - started
+                _record_model_call(name, bool(text), latency, usage, prompt, text)
+                if text:
+                    _record_model_result(name, True, latency)
+                    _summary_cache_put(
+                        summary_cache_key(name, config, prompt),
+                        name,
+                        text,
+                        getattr(usage, "total_token_count", None) or 0,
+                    )
+                    return text, name
+                logger.warning(f"generate_summary[{label}]: empty stream from {name}")
+                _record_model_result(name, False, latency, "empty stream")
+            except Exception as e:
+                logger.error(f"generate_summary[{label}]: stream {name} failed: {e}")
+                latency = time.monotonic() - started
+                _record_model_call(name, False, latency, usage, prompt, "".join(parts))
+                _record_model_result(name, False, latency, str(e)[:500])
+        if poster.posted:
+            return None, None
+        poster.reset()
+    return None, None
+
+
+def quiet_day_digest(transcript):
+    # AIを使わない定型のサマリー（SUMMARY_PROMPT の出力フォーマットに合わせる）
+    sections = []
+    for section in transcript.sections:
+        if not section.entries:
+            continue
+        heading = f"#{section.channel}"
+        if section.kind != "channel":
+            heading += f" / {section.name}"
+        lines = []
+        for entry in section.entries:
+            at = f"{entry.at.hour:02d}:{entry.at.minute:02d}"
+            content = " ".join(entry.content.split())
+            if entry.count > 1:
+                at += f"–{entry.last_at.hour:02d}:{entry.last_at.minute:02d}"
+                content += f" ×{entry.count}{entry.note}"
+            lines.append(f" • {at} {content}（{entry.author}）")
+        sections.append(f"{heading}\n" + "\n".join(lines))
+    if not sections:
+        return (
+            "投稿なし\n\n（対象期間にチャンネル・スレッドへの投稿はありませんでした）"
+        )
+    body = "\n\n".join(sections)
+    return (
+        f"{body}\n\n"
+        f"（投稿が{transcript.post_count}件のみのため、AIによる要約は省略しました）"
+    )
+
+
+def count_prompt_tokens(client, model, prompt):
+    # プロンプトのトークン数を数える。(tokens, "api" / "estimate")
+    if SUMMARY_COUNT_TOKENS:
+        from google.genai import types
+
+        try:
+            resp = client.models.count_tokens(
+                model=model,
+                contents=prompt,
+                config=types.CountTokensConfig(
+                    http_options=types.HttpOptions(timeout=30000)
+                ),
+            )
+            if resp.total_tokens is not None:
+                return resp.total_tokens, "api"
+        except Exception as e:
+            logger.warning(f"generate_summary: count_tokens failed: {e}")
+    return estimate_tokens(prompt), "estimate"
+
+
+def select_tier(prompt_tokens):
+    for tier in SUMMARY_TIERS:
+        limit = tier.get("max_prompt_tokens")
+        if limit is None or prompt_tokens <= limit:
+            return tier
+    return SUMMARY_TIERS[-1]
+
+
+def _log_summary_plan(plan):
+    logger.info(f"generate_summary: plan {json.dumps(plan, ensure_ascii=False)}")
+    metrics = _current_run.get()
+    if metrics:
+        metrics.summary_plan = plan
+
+
+def generate_summary(transcript, poster=None):
+    # poster を渡すとストリーミング生成し、完成したメッセージから順に投稿する。
+    # 投稿がほとんどない日はAIを呼ばず、定型のサマリーを返す
+    posts = transcript.post_count
+    if posts <= SUMMARY_SKIP_MAX_POSTS:
+        _log_summary_plan({"tier": "skip", "posts": posts})
+        digest = quiet_day_digest(transcript)
+        if poster is not None:
+            poster.resume_with(digest)
+        return digest
+
+    client = gemini_client()
+    cache_stats = SummaryCacheStats()
+
+    all_text = transcript.render()
+    tokens = estimate_tokens(all_text)
+    use_map_reduce = SUMMARY_MODE == "mapreduce" or (
+        SUMMARY_MODE == "auto" and tokens > SUMMARY_SINGLE_MAX_TOKENS
+    )
+    if use_map_reduce:
+        chunks = split_transcript(transcript, SUMMARY_CHUNK_TOKENS)
+        logger.info(
+            f"generate_summary: map-reduce tokens~{tokens} chunks={len(chunks)}"
+        )
+        partials = _map_chunks(client, chunks, cache_stats)
+        prompt = SUMMARY_PROMPT.format(
+            source_label=SOURCE_LABEL_PARTIAL, all_text="\n\n".join(partials)
+        )
+    else:
+        prompt = SUMMARY_PROMPT.format(source_label=SOURCE_LABEL_RAW, all_text=all_text)
+    label = "reduce" if use_map_reduce else "summary"
+
+    # 最終プロンプトのトークン数で、使うモデルの順と出力枠を決める
+    prompt_tokens, counted_by = count_prompt_tokens(client, MODEL_CANDIDATES[0], prompt)
+    tier = select_tier(prompt_tokens)
+    models = tier["models"]
+    max_output_tokens = tier["max_output_tokens"]
+    _log_summary_plan(
+        {
+            "tier": tier["name"],
+            "posts": posts,
+            "prompt_tokens": prompt_tokens,
+            "counted_by": counted_by,
+            "map_reduce": use_map_reduce,
+            "models": models,
+            "max_output_tokens": max_output_tokens,
+        }
+    )
+
+    text = name = usage = None
+    if poster is not None:
+        config = {"max_output_tokens": max_output_tokens, "temperature": 0.2}
+        cached = _cached_text(prompt, config, label, cache_stats, models)
+        if cached:
+            text, name, usage = cached
+            poster.resume_with(text)
+        else:
+            text, name = _stream_text(client, prompt, poster, label, config, models)
+            if text:
+                poster.finish()
+            else:
+                logger.warning("generate_summary: stream failed; falling back")
+    if not text:
+        text, name, usage = _generate_text(
+            client,
+            prompt,
+            max_output_tokens=max_output_tokens,
+            label=label,
+            cache_stats=cache_stats if poster is None else None,
+            models=models,
+        )
+        if text and poster is not None:
+            poster.resume_with(text)
+    logger.info(f"generate_summary: cache {cache_stats}")
+    logger.info(f"generate_summary: model health {model_health()}")
+    metrics = _current_run.get()
+    if metrics:
+        metrics.model_used = name
+        metrics.summary_cache = {
+            "hits": cache_stats.hits,
+            "misses": cache_stats.misses,
+            "saved_tokens": cache_stats.saved_tokens,
+        }
+    if text:
+        try:
+            post_discord_log_direct(f"🧠 model_used={name} usage={usage}")
+        except Exception as e_log:
+            logger.warning(f"generate_summary: model log failed: {e_log}")
+        return text
 
     # 最終フォールバック（必ず str を返す）
     fallback = "（自動生成に失敗しました。入力ログの先頭を添付します）\n\n" + (
         all_text[:800] or ""
     )
+    if poster is not None:
+        poster.resume_with(fallback)
     return fallback
 
-    raise last_err or RuntimeError("All model attempts failed")
 
+_SUMMARY_HEADING_RE = re.compile(r"^(?=#|〜)", re.M)
+
+
+def split_summary_sections(text):
+    # 「#チャンネル名」「〜AIからのフィードバック〜」の見出し行で区切る（連結すると元に戻る）
+    starts = [m.start() for m in _SUMMARY_HEADING_RE.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    return [text[a:b] for a, b in zip(starts, starts[1:] + [len(text)])]
+
+
+def _safe_cut(text, limit):
+    # 結合文字・異体字セレクタ・ZWJ の途中で切らない位置を返す
+    cut = limit
+    while cut > 1 and (
+        unicodedata.combining(text[cut])
+        or text[cut] in "\u200d\ufe0f"
+        or text[cut - 1] == "\u200d"
+    ):
+        cut -= 1
+    return cut
+
+
+def _summary_units(text):
+    # セクション単位、長すぎるセクションは行単位、長すぎる行は安全な位置で分割する
+    for section in split_summary_sections(text):
+        if len(section) <= EMBED_DESCRIPTION_LIMIT:
+            yield section
+            continue
+        for line in section.splitlines(keepends=True):
+            while len(line) > EMBED_DESCRIPTION_LIMIT:
+                cut = _safe_cut(line, EMBED_DESCRIPTION_LIMIT)
+                yield line[:cut]
+                line = line[cut:]
+            yield line
+
+
+def build_webhook_messages(text):
+    # 分割単位を埋め込み（説明文4096字）に詰め、1メッセージに最大10個・
+    # 合計6000字まで載せる。なるべく少ないWebhook呼び出しで送るため
+    messages, embeds, total = [], [], 0
+    for unit in _summary_units(text):
+        if embeds and (
+            total + len(unit) > EMBED_TOTAL_LIMIT
+            or (
+                len(embeds) == EMBEDS_PER_MESSAGE
+                and len(embeds[-1]) + len(unit) > EMBED_DESCRIPTION_LIMIT
+            )
+        ):
+            messages.append(embeds)
+            embeds, total = [], 0
+        if embeds and len(embeds[-1]) + len(unit) <= EMBED_DESCRIPTION_LIMIT:
+            embeds[-1] += unit
+        else:
+            embeds.append(unit)
+        total += len(unit)
+    if embeds:
+        messages.append(embeds)
+    return [
+        {"embeds": [{"description": d.strip("\n")} for d in m if d.strip()]}
+        for m in messages
+    ]
 
-def post_to_discord(final_summary):
-    # 2000文字ごとに分割して送信
-    for i in range(0, len(final_summary), 2000):
-        chunk = final_summary[i : i + 2000]
-        data = {"content": chunk}
-        r = requests.post(
-            WEBHOOK_URL,
-            data=json.dumps(data),
-            headers={"Content-Type": "application/json"},
+
+def _posted_digests(run_key):
+    with _state_db() as db:
+        return dict(
+            db.execute(
+                "SELECT idx, digest FROM webhook_posts WHERE run_key = ?", (run_key,)
+            ).fetchall()
         )
-        if r.status_code not in (200, 204):
-            logger.error(f"投稿失敗: {r.status_code} {r.text}")
-            _log_error_to_discord(
-                "❌ post_to_discord:", f"status={r.status_code} body={r.text[:200]}"
+
+
+def _record_post(run_key, idx, digest, message_id):
+    with _state_db() as db:
+        db.execute(
+            "INSERT OR REPLACE INTO webhook_posts"
+            " (run_key, idx, digest, message_id, posted_at) VALUES (?, ?, ?, ?, ?)",
+            (run_key, idx, digest, message_id, time.time()),
+        )
+
+
+def _send_webhook(payload):
+    # 429 は discord_request が待って再送する。5xx・通信エラーは間隔を空けて再送
+    import requests
+
+    webhook_url = current_guild().webhook_url
+    url = webhook_url + ("&" if "?" in webhook_url else "?") + "wait=true"
+    metrics = _current_run.get()
+    detail = ""
+    for attempt in range(DISCORD_MAX_RETRIES + 1):
+        if attempt and metrics:
+            metrics.retry(f"POST {urlparse(url).path}")
+        try:
+            r = discord_request(
+                "POST",
+                url,
+                data=json.dumps(payload),
+                headers={"Content-Type": "application/json"},
             )
+        except requests.RequestException as e:
+            logger.warning(f"投稿エラー（再試行 {attempt}）: {e}")
+            detail = f"error={e}"
+        else:
+            if r.status_code in (200, 204):
+                return (r.json().get("id") if r.status_code == 200 else None) or ""
+            logger.error(f"投稿失敗: {r.status_code} {r.text}")
+            detail = f"status={r.status_code} body={r.text[:200]}"
+            if r.status_code < 500:
+                break
+        # 最後の試行の後は待たない
+        if attempt < DISCORD_MAX_RETRIES:
+            time.sleep(2**attempt)
+    _log_error_to_discord(f"{guild_tag()}❌ post_to_discord:", detail)
+    return None
+
+
+def post_to_discord(final_summary, run_key=None):
+    # 見出し・行の切れ目で分割して埋め込みに詰めて送信する。
+    # run_key ごとに投稿済みメッセージを記録し、再実行時は未投稿分だけ送る。
+    # 順序を保つため、再試行しても送れなければそこで止める
+    run_key = run_key or hashlib.sha256(final_summary.encode("utf-8")).hexdigest()
+    posted = _posted_digests(run_key)
+    for idx, payload in enumerate(build_webhook_messages(final_summary)):
+        digest = hashlib.sha256(
+            json.dumps(payload, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        if posted.get(idx) == digest:
+            logger.info(f"post_to_discord: message {idx} は投稿済みのためスキップ")
+            continue
+        message_id = _send_webhook(payload)
+        if message_id is None:
             return False
+        _record_post(run_key, idx, digest, message_id)
     return True
 
 
@@ -486,7 +3120,8 @@ def send_discord_log(message):
         logger.warning("DISCORD_LOG_WEBHOOK_URL not configured")
         return
     try:
-        response = requests.post(
+        response = discord_request(
+            "POST",
             DISCORD_LOG_WEBHOOK_URL,
             data=json.dumps({"content": message}),
             headers={"Content-Type": "application/json"},
@@ -504,7 +3139,8 @@ def post_discord_log_direct(content):
     if not DISCORD_LOG_WEBHOOK_URL:
         return False, "DISCORD_LOG_WEBHOOK_URL not set"
     try:
-        resp = requests.post(
+        resp = discord_request(
+            "POST",
             DISCORD_LOG_WEBHOOK_URL,
             data=json.dumps({"content": content}),
             headers={"Content-Type": "application/json"},
@@ -527,6 +3163,12 @@ def _log_error_to_discord(prefix, message):
         logger.warning(f"Discord log send exception: {e}")
 
 
+def flush_logs():
+    # キュー送信のログハンドラーを応答前に送り切る
+    for h in logger.handlers:
+        h.flush()
+
+
 app = Flask(__name__)
 
 # 既存
@@ -536,35 +3178,750 @@ app.logger.setLevel(logging.WARNING)
 app.logger.propagate = False
 
 
-@app.route("/api/daily-summary", methods=["GET", "POST"])
-def daily_summary():
-    ok, err = post_discord_log_direct("🚀 daily-summary 開始")
-    if not ok:
-        logger.warning(f"Discord開始通知失敗: {err}")
+# --- ジョブ（collect → summarize → post）とチェックポイント ---
+PIPELINE_STAGES = ("collect", "summarize", "post")
+
+
+def create_job(window_end=None, guild=None, force=False):
+    # post_key は投稿済みメッセージの記録に使うキー。同じギルド・対象日のジョブは
+    # 同じキーにして、別ジョブになっても同じ内容を二重に投稿しない（force は別扱い）
+    window_end = window_end or datetime.datetime.now(JST)
+    guild = guild or current_guild()
+    job_id = uuid.uuid4().hex
+    post_key = lease_key(guild.guild_id, window_end)
+    if force:
+        post_key += f":{job_id}"
+    now = time.time()
+    with _state_db() as db:
+        db.execute(
+            "INSERT INTO jobs (job_id, guild_id, status, stage, window_end,"
+            " post_key, created_at, updated_at)"
+            " VALUES (?, ?, 'queued', NULL, ?, ?, ?, ?)",
+            (job_id, guild.guild_id, window_end.isoformat(), post_key, now, now),
+        )
+    return job_id
+
+
+def get_job(job_id):
+    with _state_db() as db:
+        row = db.execute(
+            "SELECT job_id, guild_id, status, stage, window_end, error, post_key,"
+            " created_at, updated_at FROM jobs WHERE job_id = ?",
+            (job_id,),
+        ).fetchone()
+        if not row:
+            return None
+        done = [
+            r[0]
+            for r in db.execute(
+                "SELECT stage FROM job_checkpoints WHERE job_id = ?"
+                " ORDER BY finished_at",
+                (job_id,),
+            )
+        ]
+    keys = (
+        "job_id",
+        "guild_id",
+        "status",
+        "stage",
+        "window_end",
+        "error",
+        "post_key",
+        "created_at",
+        "updated_at",
+    )
+    job = dict(zip(keys, row))
+    job["post_key"] = job["post_key"] or job_id  # post_key 追加前のジョブ
+    job["completed_stages"] = done
+    return job
+
+
+def _update_job(job_id, **fields):
+    fields["updated_at"] = time.time()
+    cols = ", ".join(f"{k} = ?" for k in fields)
+    with _state_db() as db:
+        db.execute(
+            f"UPDATE jobs SET {cols} WHERE job_id = ?", (*fields.values(), job_id)
+        )
+
+
+def load_checkpoint(job_id, stage):
+    with _state_db() as db:
+        row = db.execute(
+            "SELECT output FROM job_checkpoints WHERE job_id = ? AND stage = ?",
+            (job_id, stage),
+        ).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def save_checkpoint(job_id, stage, output):
+    with _state_db() as db:
+        db.execute(
+            "INSERT OR REPLACE INTO job_checkpoints"
+            " (job_id, stage, output, finished_at) VALUES (?, ?, ?, ?)",
+            (job_id, stage, json.dumps(output, ensure_ascii=False), time.time()),
+        )
+
 
-    logger.info("daily-summary: job started")
-    all_text = build_all_text()
-    logger.info(f"daily-summary: collected text length={len(all_text)}")
-    summary = generate_summary(all_text)
+def _stage_collect(job_id, window_end):
+    record_to = snapshot_path(job_id) if SNAPSHOT_RECORD else None
+    transcript = collect_transcript(
+        window_end - datetime.timedelta(days=1), record_to=record_to
+    )
+    logger.info(
+        f"daily-summary: collected sections={len(transcript.sections)}"
+        f" posts={transcript.post_count}"
+    )
+    if record_to:
+        return {"transcript": transcript.to_dict(), "snapshot": record_to}
+    return {"transcript": transcript.to_dict()}
+
+
+def _summary_title(window_end):
+    target = window_end - datetime.timedelta(days=1)
+    day_of_week = WEEKDAYS[target.weekday()]
+    return f"🗓️ {target.strftime('%Y年%m月%d日')}（{day_of_week}）サマリー\n\n"
+
+
+def _stage_summarize(post_key, window_end, collected):
+    # ストリーミング時はこのステージで投稿まで済ませ、post ステージは結果だけ返す
+    # （投稿に失敗していれば post ステージが続きを投稿し直す）
+    poster = None
+    if SUMMARY_STREAMING:
+        poster = ProgressivePoster(_summary_title(window_end), run_key=post_key)
+    summary = generate_summary(Transcript.from_dict(collected["transcript"]), poster)
     if not summary:
         logger.error("generate_summary returned empty; using fallback text")
         summary = "（自動生成に失敗しました）"
-
-    target = datetime.datetime.now(JST) - datetime.timedelta(days=1)
-    weekdays = ["月", "火", "水", "木", "金", "土", "日"]
-    day_of_week = weekdays[target.weekday()]
-    title = f"🗓️ {target.strftime('%Y年%m月%d日')}（{day_of_week}）サマリー\n\n"
-    final_summary = title + summary
-    ok2 = post_to_discord(final_summary)
+    elif not is_fallback_summary(summary):
+        # 週次・月次のまとめの材料として対象日の日次サマリーを残す
+        save_daily_summary((window_end - datetime.timedelta(days=1)).date(), summary)
+    if poster is None:
+        return {"summary": summary}
+    return {
+        "summary": summary,
+        "streamed": True,
+        "posted_ok": poster.ok,
+        "stream": poster.checkpoint(),
+    }
+
+
+def _stage_post(post_key, window_end, summarized):
+    final_summary = _summary_title(window_end) + summarized["summary"]
+    if summarized.get("streamed") and summarized["posted_ok"]:
+        ok2 = True
+    elif summarized.get("streamed") and summarized["stream"]["posted"]:
+        # ストリーミングで途中まで投稿済み: 残りのセクションだけを投稿する
+        poster = ProgressivePoster(_summary_title(window_end), run_key=post_key)
+        poster.restore(summarized["stream"])
+        poster.resume_with(summarized["summary"])
+        ok2 = poster.ok
+    else:
+        ok2 = post_to_discord(final_summary, run_key=post_key)
     logger.info(
         f"daily-summary: post_to_discord ok={ok2} total_length={len(final_summary)}"
     )
-    if ok2:
+    return {"ok": ok2, "final_summary": final_summary}
+
+
+def run_pipeline(job_id):
+    # 完了済みのステージはチェックポイントから復元し、続きから実行する
+    job = get_job(job_id)
+    window_end = datetime.datetime.fromisoformat(job["window_end"])
+    _update_job(job_id, status="running", error=None)
+    stages = {
+        "collect": lambda: _stage_collect(job_id, window_end),
+        "summarize": lambda: _stage_summarize(
+            job["post_key"], window_end, outputs["collect"]
+        ),
+        "post": lambda: _stage_post(job["post_key"], window_end, outputs["summarize"]),
+    }
+    outputs = {}
+    metrics = _current_run.get()
+    try:
+        for stage in PIPELINE_STAGES:
+            outputs[stage] = load_checkpoint(job_id, stage)
+            if (
+                stage == "collect"
+                and outputs[stage]
+                and "transcript" not in outputs[stage]
+            ):
+                # 履歴をテキストで残していた頃のチェックポイントは収集からやり直す
+                outputs[stage] = None
+            if outputs[stage] is not None:
+                logger.info(f"job {job_id}: {stage} はチェックポイントから再開")
+                if metrics:
+                    metrics.resumed_stage(stage)
+                continue
+            _update_job(job_id, stage=stage)
+            with metrics.stage(stage) if metrics else contextlib.nullcontext():
+                outputs[stage] = stages[stage]()
+            # 投稿に失敗した post は記録せず、再実行時にやり直す
+            if outputs[stage].get("ok", True):
+                save_checkpoint(job_id, stage, outputs[stage])
+    except Exception as e:
+        _update_job(job_id, status="failed", error=str(e)[:1000])
+        raise
+    ok = outputs["post"]["ok"]
+    _update_job(
+        job_id,
+        status="succeeded" if ok else "failed",
+        error=None if ok else "post_to_discord failed",
+    )
+    return outputs["post"]
+
+
+# --- 同時実行の抑止（ギルド×対象日ごとのリース） ---
+# cronの再試行・手動実行などが重なっても収集・要約・投稿は1回だけ行い、
+# 後から来た呼び出しは実行中（または直近に完了した）ジョブの結果を受け取る
+def lease_key(guild_id, window_end):
+    target = (window_end - datetime.timedelta(days=1)).date()
+    return f"daily-{guild_id}-{target.isoformat()}"
+
+
+def _job_lease_key(job):
+    window_end = datetime.datetime.fromisoformat(job["window_end"])
+    return lease_key(job["guild_id"] or DEFAULT_GUILD.guild_id, window_end)
+
+
+def active_lease(key, force=False):
+    # 有効なリースを持つジョブID（force なら完了済みのものは無視）
+    with _state_db() as db:
+        row = db.execute(
+            "SELECT job_id, status FROM leases WHERE lease_key = ? AND expires_at > ?",
+            (key, time.time()),
+        ).fetchone()
+    if not row or (force and row[1] == "done"):
+        return None
+    return row[0]
+
+
+def acquire_lease(key, job_id, force=False):
+    # (リースを持つジョブID, 取得できたか) を返す。読んで書くまでを1トランザクションで
+    now = time.time()
+    with _state_db() as db:
+        db.execute("BEGIN IMMEDIATE")
+        row = db.execute(
+            "SELECT job_id, status, expires_at FROM leases WHERE lease_key = ?",
+            (key,),
+        ).fetchone()
+        if row and row[2] > now and (row[1] == "running" or not force):
+            return row[0], False
+        db.execute(
+            "INSERT OR REPLACE INTO leases (lease_key, job_id, status, expires_at)"
+            " VALUES (?, ?, 'running', ?)",
+            (key, job_id, now + LEASE_TTL_SECONDS),
+        )
+    return job_id, True
+
+
+def _renew_lease(key, job_id):
+    with _state_db() as db:
+        return db.execute(
+            "UPDATE leases SET expires_at = ? WHERE lease_key = ? AND job_id = ?"
+            " AND status = 'running'",
+            (time.time() + LEASE_TTL_SECONDS, key, job_id),
+        ).rowcount
+
+
+def _release_lease(key, job_id):
+    # 成功したら REUSE 秒だけ結果を使い回す。失敗時は消して再実行できるようにする
+    job = get_job(job_id)
+    with _state_db() as db:
+        if job and job["status"] == "succeeded":
+            db.execute(
+                "UPDATE leases SET status = 'done', expires_at = ?"
+                " WHERE lease_key = ? AND job_id = ?",
+                (time.time() + LEASE_REUSE_SECONDS, key, job_id),
+            )
+        else:
+            db.execute(
+                "DELETE FROM leases WHERE lease_key = ? AND job_id = ?", (key, job_id)
+            )
+
+
+@contextlib.contextmanager
+def holding_lease(key, job_id):
+    # 実行中はバックグラウンドでリースを延長し続ける
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(LEASE_TTL_SECONDS / 3):
+            if not _renew_lease(key, job_id):
+                logger.warning(f"lease {key}: 延長できませんでした（job {job_id}）")
+
+    keeper = threading.Thread(target=renew, name=f"lease-{job_id}", daemon=True)
+    keeper.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        keeper.join()
+        _release_lease(key, job_id)
+
+
+def _unfinished_job(guild_id, key):
+    # 同じギルド・対象日で完了していない最新のジョブ（落ちた・失敗した実行）
+    with _state_db() as db:
+        rows = db.execute(
+            "SELECT job_id, window_end FROM jobs WHERE guild_id = ?"
+            " AND status IN ('queued', 'running', 'failed') AND created_at > ?"
+            " ORDER BY created_at DESC",
+            (guild_id, time.time() - 2 * 86400),
+        ).fetchall()
+    for job_id, window_end in rows:
+        if lease_key(guild_id, datetime.datetime.fromisoformat(window_end)) == key:
+            return job_id
+    return None
+
+
+def claim_job(guild, force=False):
+    # 実行中（または直近に完了した）同じ対象日のジョブがあればそのIDを返す。
+    # なければ、リースの切れた未完了のジョブ（force なら新しいジョブ）のリースを取り、
+    # チェックポイントの続きから実行させる。(job_id, 相乗りか)
+    window_end = datetime.datetime.now(JST)
+    key = lease_key(guild.guild_id, window_end)
+    holder = active_lease(key, force)
+    if holder:
+        return holder, True
+    job_id = None if force else _unfinished_job(guild.guild_id, key)
+    created = job_id is None
+    if created:
+        job_id = create_job(window_end, guild, force)
+    else:
+        logger.warning(f"lease {key}: 未完了の job {job_id} を続きから再開")
+    holder, acquired = acquire_lease(key, job_id, force)
+    if not acquired:
+        if created:
+            _update_job(job_id, status="skipped", error=f"attached to job {holder}")
+        return holder, True
+    return job_id, False
+
+
+def _job_result(job_id):
+    job = get_job(job_id)
+    if job["status"] != "succeeded":
+        raise RuntimeError(f"job {job_id} failed: {job['error']}")
+    result = load_checkpoint(job_id, "post")
+    return {**result, "job_id": job_id, "attached": True}
+
+
+def wait_for_job(job_id, key, force=False):
+    # 実行中のジョブの完了を待って結果を返す。リースが切れた（実行側が落ちた）
+    # 場合は自分がリースを取ってチェックポイントの続きから実行する
+    deadline = time.monotonic() + LEASE_WAIT_SECONDS
+    while True:
+        job = get_job(job_id)
+        if job and job["status"] in ("succeeded", "failed"):
+            if active_lease(key) != job_id or job["status"] == "succeeded":
+                return _job_result(job_id)
+        elif active_lease(key) != job_id:
+            holder, acquired = acquire_lease(key, job_id, force)
+            if acquired:
+                logger.warning(f"lease {key}: job {job_id} を引き継いで再開")
+                with holding_lease(key, job_id):
+                    return _execute_job(job_id)
+            job_id = holder
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"job {job_id} did not finish in time")
+        time.sleep(1)
+
+
+def _run_job(job_id, force=False, leased=False):
+    # リースを取れたら（claim_job で取得済みなら leased=True）実行し、
+    # 取れなければリースを持つジョブの結果を待つ
+    key = _job_lease_key(get_job(job_id))
+    if not leased:
+        holder, acquired = acquire_lease(key, job_id, force)
+        if not acquired:
+            logger.info(f"daily-summary: job {holder} の結果を待ちます")
+            return wait_for_job(holder, key, force)
+    with holding_lease(key, job_id):
+        return _execute_job(job_id)
+
+
+def _execute_job(job_id):
+    ok, err = post_discord_log_direct(f"{guild_tag()}🚀 daily-summary 開始")
+    if not ok:
+        logger.warning(f"Discord開始通知失敗: {err}")
+
+    logger.info(f"daily-summary: job started job_id={job_id}")
+    metrics = RunMetrics(job_id)
+    token = _current_run.set(metrics)
+    try:
+        result = run_pipeline(job_id)
+        metrics.status = "succeeded" if result["ok"] else "failed"
+    except Exception:
+        metrics.status = "failed"
+        raise
+    finally:
+        _current_run.reset(token)
+        try:
+            record = save_run_metrics(metrics)
+            logger.info(f"run metrics: {json.dumps(record, ensure_ascii=False)}")
+        except Exception as e:
+            logger.warning(f"run metrics save failed: {e}")
+    if result["ok"]:
         # 成功時も直送（任意）
-        post_discord_log_direct("✅ daily-summary 成功")
+        post_discord_log_direct(f"{guild_tag()}✅ daily-summary 成功")
     else:
         logger.error("❌ daily-summary 失敗")
-    return jsonify({"status": "success", "summary": final_summary})
+    return {**result, "job_id": job_id}
+
+
+def _run_in_guild(guild, label, fn, *args, **fields):
+    # ギルドを切り替えて fn を実行する。失敗は例外にせず結果に error として返す
+    token = _current_guild.set(guild)
+    entry = {"guild_id": guild.guild_id, "name": guild.name, **fields}
+    try:
+        result = fn(*args)
+        entry["status"] = "success" if result["ok"] else "error"
+        entry["summary"] = result["final_summary"]
+        if result.get("attached"):
+            entry.update(job_id=result["job_id"], attached=True)
+    except Exception as e:
+        logger.error(f"daily-summary: {label} failed: {e}")
+        _log_error_to_discord(f"🔥 {label} failed:", f"{guild_tag()}{e}")
+        entry["status"] = "error"
+        entry["error"] = str(e)
+    finally:
+        _current_guild.reset(token)
+    return entry
+
+
+def _run_guild_job(guild, job_id, force=False, leased=False):
+    return _run_in_guild(
+        guild, f"job {job_id}", _run_job, job_id, force, leased, job_id=job_id
+    )
+
+
+def _run_guild_rollup(guild, kind):
+    return _run_in_guild(guild, f"rollup {kind}", run_rollup, kind, rollup=kind)
+
+
+def run_guilds(fn, targets):
+    # fn(GuildConfig, *args) をギルドごとのスレッドで並行に実行する。
+    # Discordのレート制限とGeminiの同時実行枠はプロセス内で共有される
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, min(GUILD_CONCURRENCY, len(targets)))
+    ) as pool:
+        futures = [pool.submit(fn, *args) for args in targets]
+        return [f.result() for f in futures]
+
+
+def _run_job_in_background(job_id, guild=None, force=False, leased=False):
+    def target():
+        try:
+            _run_guild_job(guild or current_guild(), job_id, force, leased)
+        finally:
+            flush_logs()
+
+    threading.Thread(target=target, name=f"job-{job_id}", daemon=True).start()
+
+
+# --- 週次・月次のまとめ（保存済みの日次サマリーから作る） ---
+ROLLUP_KINDS = ("weekly", "monthly")
+# これより長い期間（月次など）は7日ずつ部分的にまとめてから統合する
+ROLLUP_CHUNK_DAYS = 7
+
+ROLLUP_SOURCE_DAILY = "【日次サマリー】"
+ROLLUP_SOURCE_PARTIAL = (
+    "【期間の一部ごとのまとめ】\n"
+    "（日次サマリーを数日ずつまとめたものです。これを統合してください）"
+)
+
+ROLLUP_PROMPT = """【タスク】
+以下は{period}の日次サマリーです。これを統合し、{kind_label}を作成してください。
+
+【要件】
+チャンネルごとに見出し（例：#チャンネル名）を付け、期間中の主な出来事・決定事項・進行中の案件を日付付きで箇条書きにまとめてください。
+同じ話題が複数日にまたがる場合は1項目にまとめ、経過と結論が分かるように書いてください。
+cronなどの定期的な自動投稿は、件数と異常の有無だけに絞ってください。
+「（記録なし）」の日は日次サマリーがありません。内容を推測で補わないでください。
+最後に「〜AIからのフィードバック〜」として、期間を通して見たチームの良い点・課題・次の期間に向けた提案を率直に述べてください。
+
+【備考】
+レスポンスには、"はい、承知いたしました"などの文章は含めないでください。
+タイトルはすでに手動で記述しているので、不要です。本文から始めてください。
+
+---
+{source_label}
+{summaries}
+---
+"""
+
+
+def is_fallback_summary(text):
+    return text.startswith("（自動生成に失敗しました")
+
+
+def save_daily_summary(day, summary):
+    with _state_db() as db:
+        db.execute(
+            "INSERT OR REPLACE INTO daily_summaries"
+            " (guild_id, day, summary, created_at) VALUES (?, ?, ?, ?)",
+            (current_guild().guild_id, day.isoformat(), summary, time.time()),
+        )
+
+
+def load_daily_summaries(start, end):
+    with _state_db() as db:
+        rows = db.execute(
+            "SELECT day, summary FROM daily_summaries"
+            " WHERE guild_id = ? AND day BETWEEN ? AND ?",
+            (current_guild().guild_id, start.isoformat(), end.isoformat()),
+        ).fetchall()
+    return {datetime.date.fromisoformat(day): summary for day, summary in rows}
+
+
+def rollup_period(kind, today=None):
+    # weekly: 前日までの7日間、monthly: 前月（いずれもJSTの日付で両端を含む）
+    today = today or datetime.datetime.now(JST).date()
+    if kind == "weekly":
+        end = today - datetime.timedelta(days=1)
+        return end - datetime.timedelta(days=6), end
+    end = today.replace(day=1) - datetime.timedelta(days=1)
+    return end.replace(day=1), end
+
+
+def _rollup_title(kind, start, end):
+    if kind == "monthly":
+        return f"📅 {start.strftime('%Y年%m月')} 月次サマリー\n\n"
+    return (
+        f"📅 {start.strftime('%Y年%m月%d日')}（{WEEKDAYS[start.weekday()]}）〜"
+        f"{end.strftime('%m月%d日')}（{WEEKDAYS[end.weekday()]}）週次サマリー\n\n"
+    )
+
+
+def _backfill_daily_summary(day):
+    # 保存済みサマリーのない日は、その日（JSTの0時〜24時）の生ログから作る
+    since = datetime.datetime.combine(day, datetime.time(), JST)
+    transcript = collect_transcript(since, since + datetime.timedelta(days=1))
+    summary = generate_summary(transcript)
+    if is_fallback_summary(summary):
+        return None
+    save_daily_summary(day, summary)
+    return summary
+
+
+def _daily_blocks(days, summaries):
+    return [
+        f"### {day.strftime('%Y-%m-%d')}（{WEEKDAYS[day.weekday()]}）\n"
+        f"{summaries.get(day) or '（記録なし）'}\n"
+        for day in days
+    ]
+
+
+def build_rollup(kind, start, end):
+    # 期間の日次サマリーを集め、足りない日だけ生ログから補ってから統合する。
+    # 入力は日数×日次サマリーの長さで決まり、期間中の投稿量には比例しない
+    days = [start + datetime.timedelta(days=i) for i in range((end - start).days + 1)]
+    summaries = load_daily_summaries(start, end)
+    missing = [day for day in days if day not in summaries]
+    if len(missing) > ROLLUP_MAX_BACKFILL_DAYS:
+        logger.warning(
+            f"rollup {kind}: 日次サマリーのない日が{len(missing)}日あり、"
+            f"直近{ROLLUP_MAX_BACKFILL_DAYS}日分のみ生ログから作成します"
+        )
+    backfill = (
+        missing[-ROLLUP_MAX_BACKFILL_DAYS:] if ROLLUP_MAX_BACKFILL_DAYS > 0 else []
+    )
+    for day in backfill:
+        summaries[day] = _backfill_daily_summary(day)
+    logger.info(
+        f"rollup {kind}: {start}〜{end} stored={len(days) - len(missing)}"
+        f" backfilled={sum(1 for d in missing if summaries.get(d))}"
+    )
+
+    client = gemini_client()
+    period = f"{start.isoformat()}〜{end.isoformat()}"
+    kind_label = "週次サマリー" if kind == "weekly" else "月次サマリー"
+    blocks = _daily_blocks(days, summaries)
+    source_label = ROLLUP_SOURCE_DAILY
+    if len(days) > ROLLUP_CHUNK_DAYS:
+
+        def summarize_chunk(i):
+            chunk = days[i : i + ROLLUP_CHUNK_DAYS]
+            text, _, _ = _generate_text(
+                client,
+                ROLLUP_PROMPT.format(
+                    period=f"{chunk[0].isoformat()}〜{chunk[-1].isoformat()}",
+                    kind_label="この期間のまとめ",
+                    source_label=ROLLUP_SOURCE_DAILY,
+                    summaries="\n".join(blocks[i : i + ROLLUP_CHUNK_DAYS]),
+                ),
+                max_output_tokens=4000,
+                label=f"rollup {kind} {chunk[0]}",
+            )
+            return f"### {chunk[0]}〜{chunk[-1]}\n{text or '（まとめ失敗）'}\n"
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, SUMMARY_MAP_WORKERS)
+        ) as pool:
+            futures = [
+                pool.submit(contextvars.copy_context().run, summarize_chunk, i)
+                for i in range(0, len(days), ROLLUP_CHUNK_DAYS)
+            ]
+            blocks = [f.result() for f in futures]
+        source_label = ROLLUP_SOURCE_PARTIAL
+
+    text, name, usage = _generate_text(
+        client,
+        ROLLUP_PROMPT.format(
+            period=period,
+            kind_label=kind_label,
+            source_label=source_label,
+            summaries="\n".join(blocks),
+        ),
+        label=f"rollup {kind}",
+    )
+    if not text:
+        raise RuntimeError(f"rollup {kind}: generation failed")
+    logger.info(f"rollup {kind}: model={name} usage={usage}")
+    return text
+
+
+def run_rollup(kind, today=None):
+    start, end = rollup_period(kind, today)
+    run_key = f"rollup-{kind}-{current_guild().guild_id}-{start.isoformat()}"
+    metrics = RunMetrics(run_key)
+    token = _current_run.set(metrics)
+    try:
+        with metrics.stage("rollup"):
+            final_summary = _rollup_title(kind, start, end) + build_rollup(
+                kind, start, end
+            )
+        with metrics.stage("post"):
+            ok = post_to_discord(final_summary, run_key=run_key)
+        metrics.status = "succeeded" if ok else "failed"
+    except Exception:
+        metrics.status = "failed"
+        raise
+    finally:
+        _current_run.reset(token)
+        try:
+            save_run_metrics(metrics)
+        except Exception as e:
+            logger.warning(f"run metrics save failed: {e}")
+    return {"ok": ok, "final_summary": final_summary}
+
+
+@app.route("/api/daily-summary", methods=["GET", "POST"])
+def daily_summary():
+    # ?mode=job: ジョブIDをすぐ返し、バックグラウンドで実行する
+    # ?resume=<job_id>: 既存ジョブを最後に完了したステージの続きから再実行する
+    # ?guild=<guild_id>: 複数ギルド設定のうち指定したギルドだけ実行する
+    # ?rollup=weekly|monthly: 保存済みの日次サマリーから週次・月次のまとめを作る
+    # ?force=1: 同じ対象日の直近の完了結果を使い回さず実行し直す（実行中なら相乗り）
+    # 同じギルド・対象日の実行が進行中なら新しく始めず、その結果を返す
+    guilds = load_guild_configs()
+    if not guilds:
+        return (
+            jsonify({"status": "error", "message": "no guild with a webhook URL"}),
+            500,
+        )
+    force = request.args.get("force") == "1"
+    job_id = request.args.get("resume")
+    if job_id:
+        job = get_job(job_id)
+        if not job:
+            return jsonify({"status": "error", "message": "job not found"}), 404
+        guild_id = job["guild_id"] or DEFAULT_GUILD.guild_id
+        guilds = [g for g in guilds if g.guild_id == guild_id]
+    elif request.args.get("guild"):
+        guilds = [g for g in guilds if g.guild_id == request.args["guild"]]
+    if not guilds:
+        return jsonify({"status": "error", "message": "guild not configured"}), 404
+    if request.args.get("rollup"):
+        return _rollup_response(request.args["rollup"], guilds)
+    # (guild, job_id, force, leased)。相乗り・再開はリースを持たずに渡し、
+    # _run_job 側でリースを取って実行するか結果を待つかを決める
+    targets = []
+    for g in guilds:
+        if job_id:
+            targets.append((g, job_id, force, False))
+        else:
+            target_job_id, attached = claim_job(g, force)
+            targets.append((g, target_job_id, force, not attached))
+
+    if request.args.get("mode") == "job":
+        jobs = []
+        for guild, target_job_id, _, leased in targets:
+            attached = not leased and not job_id
+            if not attached:
+                _run_job_in_background(target_job_id, guild, force, leased)
+            jobs.append(
+                {
+                    "guild_id": guild.guild_id,
+                    "job_id": target_job_id,
+                    "status_url": f"/api/daily-summary/jobs/{target_job_id}",
+                    **({"attached": True} if attached else {}),
+                }
+            )
+        if not MULTI_GUILD:
+            return jsonify({"status": "accepted", **jobs[0]}), 202
+        return jsonify({"status": "accepted", "jobs": jobs}), 202
+
+    if not MULTI_GUILD:
+        result = _run_job(*targets[0][1:])
+        flush_logs()
+        return jsonify(
+            {
+                "status": "success",
+                "summary": result["final_summary"],
+                "job_id": result["job_id"],
+                **({"attached": True} if result.get("attached") else {}),
+            }
+        )
+
+    return _guild_results_response(run_guilds(_run_guild_job, targets))
+
+
+def _rollup_response(kind, guilds):
+    if kind not in ROLLUP_KINDS:
+        return jsonify({"status": "error", "message": "unknown rollup"}), 400
+    if not MULTI_GUILD:
+        result = run_rollup(kind)
+        flush_logs()
+        return jsonify(
+            {"status": "success", "summary": result["final_summary"], "rollup": kind}
+        )
+    return _guild_results_response(
+        run_guilds(_run_guild_rollup, [(g, kind) for g in guilds])
+    )
+
+
+def _guild_results_response(results):
+    flush_logs()
+    failed = sum(r["status"] != "success" for r in results)
+    if not failed:
+        status = "success"
+    elif failed < len(results):
+        status = "partial"
+    else:
+        status = "error"
+    return jsonify({"status": status, "results": results}), (
+        500 if status == "error" else 200
+    )
+
+
+@app.route("/api/daily-summary/jobs/<job_id>", methods=["GET"])
+def daily_summary_job(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({"status": "error", "message": "job not found"}), 404
+    job["stages"] = list(PIPELINE_STAGES)
+    return jsonify(job)
+
+
+@app.route("/api/metrics", methods=["GET"])
+def run_metrics_history():
+    # 直近の実行記録（新しい順）。?limit= で件数を指定する
+    try:
+        limit = min(int(request.args.get("limit", "50")), RUN_METRICS_HISTORY)
+    except ValueError:
+        return jsonify({"status": "error", "message": "invalid limit"}), 400
+    return jsonify({"runs": recent_run_metrics(limit), "model_health": model_health()})
 
 
 @app.errorhandler(Exception)
@@ -577,11 +3934,31 @@ def handle_exception(e):
         _log_error_to_discord("🔥 unhandled:", error_msg[:1500])
     except Exception:
         pass
+    flush_logs()
     return jsonify({"status": "error", "message": str(e)}), 500
 
 
-if __name__ == "__main__":
-    from dotenv import load_dotenv
+def _replay_main(argv):
+    # python api/daily-summary.py replay <snapshot> [--since ISO] [--until ISO]
+    import argparse
 
-    load_dotenv()
-    app.run(host="0.0.0.0", port=5001, debug=True)
+    parser = argparse.ArgumentParser(prog="daily-summary.py replay")
+    parser.add_argument("snapshot")
+    parser.add_argument("--since", type=datetime.datetime.fromisoformat)
+    parser.add_argument("--until", type=datetime.datetime.fromisoformat)
+    parser.add_argument(
+        "--transcript-only", action="store_true", help="要約せず履歴テキストだけ出力"
+    )
+    args = parser.parse_args(argv)
+    all_text, summary = replay_snapshot(
+        args.snapshot, args.since, args.until, summarize=not args.transcript_only
+    )
+    print(all_text if args.transcript_only else summary)
+    flush_logs()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["replay"]:
+        _replay_main(sys.argv[2:])
+    else:
+        app.run(host="0.0.0.0", port=5001, debug=True)
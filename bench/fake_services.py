@@ -0,0 +1,414 @@
+"""ベンチマーク用のローカルなDiscord API / Gemini API の代替サーバー。
+
+本番と同じURL構成（/api/v10/... と /v1beta/models/...）で応答し、
+リクエスト数・転送量をルートごとに数える。
+"""
+
+import datetime
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DISCORD_EPOCH_MS = 1420070400000
+
+BOT_TEMPLATES = [
+    "定期処理：新規名刺データなし",
+    "定期処理：新規名刺データ {n}件を登録しました",
+    "バックアップ完了 ({n} files)",
+]
+
+
+def snowflake(dt, seq=0):
+    return str(((int(dt.timestamp() * 1000) - DISCORD_EPOCH_MS) << 22) + seq)
+
+
+def _iso(dt):
+    return dt.isoformat().replace("+00:00", "Z")
+
+
+class SyntheticGuild:
+    # N チャンネル × M スレッド × K メッセージの合成ギルド。
+    # メッセージは直近 span_hours 時間に均等に散らばり、一部はBotの定型投稿になる
+    def __init__(
+        self,
+        channels=20,
+        threads=4,
+        messages=50,
+        *,
+        span_hours=36,
+        bot_ratio=0.2,
+        forbidden_ratio=0.05,
+        members=15,
+        seed=0,
+    ):
+        rnd = random.Random(seed)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.guild_id = "1"
+        self.channels = []
+        self.active_threads = []
+        self.archived_threads = {}
+        self.messages = {}
+        self.forbidden = set()
+        self.members = [
+            {
+                "user": {
+                    "id": str(10_000 + i),
+                    "username": f"user{i}",
+                    "global_name": f"User {i}",
+                },
+                "nick": None,
+            }
+            for i in range(members)
+        ]
+        self.roles = [{"id": "500", "name": "営業"}, {"id": "501", "name": "開発"}]
+        next_id = 100
+        for c in range(channels):
+            next_id += 1
+            ch = {"id": str(next_id), "name": f"channel-{c}", "type": 0, "position": c}
+            self.channels.append(ch)
+            if rnd.random() < forbidden_ratio:
+                self.forbidden.add(ch["id"])
+            self._fill(ch, messages, now, span_hours, bot_ratio, rnd)
+            for t in range(threads):
+                next_id += 1
+                archived = t % 2 == 1
+                th = {
+                    "id": str(next_id),
+                    "name": f"thread-{c}-{t}",
+                    "parent_id": ch["id"],
+                    "type": 11,
+                    "thread_metadata": {
+                        "archived": archived,
+                        "archive_timestamp": _iso(
+                            now - datetime.timedelta(hours=rnd.uniform(0, span_hours))
+                        ),
+                    },
+                }
+                self._fill(th, messages // 2, now, span_hours, bot_ratio, rnd)
+                if archived:
+                    self.archived_threads.setdefault(ch["id"], []).append(th)
+                else:
+                    self.active_threads.append(th)
+        for threads_ in self.archived_threads.values():
+            threads_.sort(
+                key=lambda t: t["thread_metadata"]["archive_timestamp"], reverse=True
+            )
+        # 音声チャンネル（収集対象外）も混ぜる
+        self.channels.append({"id": "99", "name": "voice", "type": 2})
+
+    def _fill(self, channel, count, now, span_hours, bot_ratio, rnd):
+        msgs = []
+        for i in range(count):
+            dt = now - datetime.timedelta(hours=span_hours * (1 - (i + 1) / count))
+            if rnd.random() < bot_ratio:
+                author = {"id": "1", "username": "cron-bot", "bot": True}
+                content = rnd.choice(BOT_TEMPLATES).format(n=rnd.randint(0, 9))
+            else:
+                m = rnd.choice(self.members)["user"]
+                author = dict(m)
+                content = f"{channel['name']} の件、{i}番目の連絡です <@{m['id']}>"
+            msgs.append(
+                {
+                    "id": snowflake(dt, i % 4096),
+                    "timestamp": _iso(dt),
+                    "author": author,
+                    "content": content,
+                }
+            )
+        self.messages[channel["id"]] = msgs
+        channel["last_message_id"] = msgs[-1]["id"] if msgs else None
+
+    @property
+    def total_messages(self):
+        return sum(len(m) for m in self.messages.values())
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.rate_limited = 0
+        self.webhook_posts = []
+
+    def record(self, route, bytes_in, bytes_out):
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "request_total": sum(self.requests.values()),
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "rate_limited": self.rate_limited,
+                "webhook_posts": len(self.webhook_posts),
+            }
+
+
+class _Bucket:
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.remaining = limit
+        self.reset_at = 0.0
+
+    def take(self):
+        now = time.monotonic()
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + self.window
+        if self.remaining <= 0:
+            return False, self.reset_at - now
+        self.remaining -= 1
+        return True, self.reset_at - now
+
+
+class FakeServices:
+    # Discord API・Webhook・Gemini API をひとつのHTTPサーバーで代替する
+    def __init__(
+        self,
+        guild,
+        *,
+        bucket_limit=50,
+        bucket_window=1.0,
+        gemini_latency=0.2,
+        gemini_latency_per_1k_tokens=0.01,
+    ):
+        self.guild = guild
+        self.bucket_limit = bucket_limit
+        self.bucket_window = bucket_window
+        self.gemini_latency = gemini_latency
+        self.gemini_latency_per_1k_tokens = gemini_latency_per_1k_tokens
+        self.stats = Stats()
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def take(self, bucket_key):
+        with self._buckets_lock:
+            bucket = self._buckets.setdefault(
+                bucket_key, _Bucket(self.bucket_limit, self.bucket_window)
+            )
+            ok, reset_after = bucket.take()
+            return ok, bucket.remaining, reset_after
+
+    def _handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, route, status, payload, headers=None, raw=None):
+                body = raw if raw is not None else json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+                services.stats.record(route, self._bytes_in, len(body))
+
+            def _read_body(self):
+                n = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(n) if n else b""
+                self._bytes_in = len(self.requestline) + n
+                return body
+
+            def do_GET(self):
+                self._read_body()
+                url = urlparse(self.path)
+                if url.path.startswith("/api/v10/"):
+                    return self._discord(url)
+                self._reply("GET ?", 404, {"message": "not found"})
+
+            def do_POST(self):
+                body = self._read_body()
+                url = urlparse(self.path)
+                if url.path.startswith("/api/webhooks/"):
+                    services.stats.webhook_posts.append(json.loads(body or b"{}"))
+                    wait = "wait=true" in (url.query or "")
+                    return self._reply(
+                        "POST /webhooks",
+                        200 if wait else 204,
+                        {"id": "1"} if wait else None,
+                        raw=None if wait else b"",
+                    )
+                m = re.search(r"/models/([^/:]+):(\w+)", url.path)
+                if m:
+                    return self._gemini(
+                        m.group(1), m.group(2), json.loads(body or b"{}")
+                    )
+                self._reply("POST ?", 404, {"message": "not found"})
+
+            def _discord(self, url):
+                path = url.path[len("/api/v10") :]
+                q = {k: v[0] for k, v in parse_qs(url.query).items()}
+                route = "GET " + re.sub(r"/\d+", "/{id}", path)
+                # メジャーパラメータ（チャンネル/ギルドID）ごとのバケット
+                ok, remaining, reset_after = services.take(route + path.split("/")[2])
+                headers = {
+                    "X-RateLimit-Limit": str(services.bucket_limit),
+                    "X-RateLimit-Remaining": str(max(0, remaining)),
+                    "X-RateLimit-Reset-After": f"{reset_after:.3f}",
+                    "X-RateLimit-Bucket": route,
+                }
+                if not ok:
+                    services.stats.rate_limited += 1
+                    return self._reply(
+                        route,
+                        429,
+                        {
+                            "message": "You are being rate limited.",
+                            "retry_after": reset_after,
+                            "global": False,
+                        },
+                        headers,
+                    )
+                g = services.guild
+                if re.fullmatch(r"/guilds/\d+/channels", path):
+                    return self._reply(route, 200, g.channels, headers)
+                if re.fullmatch(r"/guilds/\d+/threads/active", path):
+                    return self._reply(
+                        route, 200, {"threads": g.active_threads}, headers
+                    )
+                if re.fullmatch(r"/guilds/\d+/roles", path):
+                    return self._reply(route, 200, g.roles, headers)
+                if re.fullmatch(r"/guilds/\d+/members", path):
+                    after = int(q.get("after", 0))
+                    limit = int(q.get("limit", 1))
+                    page = [m for m in g.members if int(m["user"]["id"]) > after][
+                        :limit
+                    ]
+                    return self._reply(route, 200, page, headers)
+                m = re.fullmatch(r"/channels/(\d+)/threads/archived/public", path)
+                if m:
+                    if m.group(1) in g.forbidden:
+                        return self._reply(route, 403, {"message": "Missing Access"})
+                    threads = g.archived_threads.get(m.group(1), [])
+                    if "before" in q:
+                        threads = [
+                            t
+                            for t in threads
+                            if t["thread_metadata"]["archive_timestamp"] < q["before"]
+                        ]
+                    limit = int(q.get("limit", 50))
+                    return self._reply(
+                        route,
+                        200,
+                        {"threads": threads[:limit], "has_more": len(threads) > limit},
+                        headers,
+                    )
+                m = re.fullmatch(r"/channels/(\d+)/messages", path)
+                if m:
+                    if m.group(1) in g.forbidden:
+                        return self._reply(route, 403, {"message": "Missing Access"})
+                    msgs = g.messages.get(m.group(1), [])
+                    limit = int(q.get("limit", 50))
+                    if "after" in q:
+                        sel = [x for x in msgs if int(x["id"]) > int(q["after"])][
+                            :limit
+                        ]
+                    elif "before" in q:
+                        sel = [x for x in msgs if int(x["id"]) < int(q["before"])][
+                            -limit:
+                        ]
+                    else:
+                        sel = msgs[-limit:]
+                    return self._reply(route, 200, list(reversed(sel)), headers)
+                self._reply(route, 404, {"message": "Unknown route"})
+
+            def _gemini(self, model, op, req):
+                route = f"POST gemini:{op}"
+                text = "".join(
+                    p.get("text", "")
+                    for c in req.get("contents", [])
+                    for p in c.get("parts", [])
+                )
+                tokens = max(1, len(text) // 2)
+                if op == "countTokens":
+                    return self._reply(route, 200, {"totalTokens": tokens})
+                time.sleep(
+                    services.gemini_latency
+                    + services.gemini_latency_per_1k_tokens * tokens / 1000
+                )
+                channels = re.findall(r"^--- チャンネル: (#\S+)", text, re.M) or [
+                    "#general"
+                ]
+                out = "\n\n".join(
+                    f"{name}\n • 10:00 ベンチマーク用の要約（{model}）"
+                    for name in channels
+                )
+                out += "\n\n〜AIからのフィードバック〜\nベンチマーク用の固定文です。"
+                usage = {
+                    "promptTokenCount": tokens,
+                    "candidatesTokenCount": len(out) // 2,
+                    "totalTokenCount": tokens + len(out) // 2,
+                }
+                if op == "streamGenerateContent":
+                    raw = b""
+                    for i in range(0, len(out), 200):
+                        part = {
+                            "candidates": [
+                                {
+                                    "content": {
+                                        "parts": [{"text": out[i : i + 200]}],
+                                        "role": "model",
+                                    }
+                                }
+                            ]
+                        }
+                        raw += b"data: " + json.dumps(part).encode() + b"\r\n\r\n"
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.send_header("Content-Length", str(len(raw)))
+                    self.end_headers()
+                    self.wfile.write(raw)
+                    services.stats.record(route, self._bytes_in, len(raw))
+                    return
+                return self._reply(
+                    route,
+                    200,
+                    {
+                        "candidates": [
+                            {
+                                "content": {"parts": [{"text": out}], "role": "model"},
+                                "finishReason": "STOP",
+                            }
+                        ],
+                        "usageMetadata": usage,
+                    },
+                )
+
+        return Handler
@@ -0,0 +1,96 @@
+"""api/daily-summary.py のコールドスタート（モジュール読み込み）時間を計測する。
+
+毎回新しいPythonプロセスで読み込み、中央値と最小値を表示する。
+-X importtime の結果から、読み込みに時間のかかったモジュールも併せて表示する。
+
+    python bench/import_time.py --runs 5
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+MODULE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "api",
+    "daily-summary.py",
+)
+
+_SNIPPET = f"""
+import importlib.util, time
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location("daily_summary", {MODULE_PATH!r})
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+print(time.perf_counter() - started)
+"""
+
+_IMPORTTIME_RE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)")
+
+
+def _env(state_dir):
+    env = dict(os.environ)
+    env.update(
+        {
+            "DISCORD_TOKEN": "bench-token",
+            "DISCORD_WEBHOOK_URL": "http://127.0.0.1:9/api/webhooks/1/bench",
+            "SUMMARY_STATE_DIR": state_dir,
+            "LOG_LEVEL": "WARNING",
+        }
+    )
+    env.pop("DISCORD_LOG_WEBHOOK_URL", None)
+    return env
+
+
+def measure(runs):
+    with tempfile.TemporaryDirectory() as state_dir:
+        env = _env(state_dir)
+        seconds = []
+        for _ in range(runs):
+            out = subprocess.run(
+                [sys.executable, "-c", _SNIPPET],
+                env=env,
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+            seconds.append(float(out.stdout.strip().splitlines()[-1]))
+        profile = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", _SNIPPET],
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+    # トップレベルの import（インデント1段）だけを累積時間の大きい順に
+    top = []
+    for line in profile.stderr.splitlines():
+        m = _IMPORTTIME_RE.match(line)
+        if m and len(m.group(2)) == 1:
+            top.append((int(m.group(1)), m.group(3)))
+    top.sort(reverse=True)
+    return seconds, top
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    seconds, top = measure(args.runs)
+    print(
+        f"import: median={statistics.median(seconds):.3f}s"
+        f" min={min(seconds):.3f}s ({args.runs} runs)"
+    )
+    for us, name in top[: args.top]:
+        print(f"  {us / 1e6:7.3f}s  {name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
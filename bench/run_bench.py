@@ -0,0 +1,256 @@
+"""api/daily-summary.py のオフラインベンチマーク。
+
+ローカルの代替サーバー（bench/fake_services.py）に向けてパイプラインを実行し、
+collect_transcript / generate_summary / post_to_discord ごとに
+所要時間・リクエスト数・転送量・ピークメモリを計測する。
+
+    python bench/run_bench.py --channels 50 --threads 4 --messages 200 --runs 2
+    python bench/run_bench.py --json result.json --baseline previous.json
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_services import FakeServices, SyntheticGuild  # noqa: E402
+
+MODULE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "api",
+    "daily-summary.py",
+)
+
+
+def load_module(services, state_dir, log_level):
+    # 本番と同じ環境変数経由で代替サーバーを向かせてから読み込む
+    os.environ.update(
+        {
+            "DISCORD_TOKEN": "bench-token",
+            "DISCORD_WEBHOOK_URL": f"{services.base_url}/api/webhooks/1/bench",
+            "DISCORD_API_BASE": f"{services.base_url}/api/v10",
+            "GEMINI_API_KEY": "bench-key",
+            "GOOGLE_GEMINI_BASE_URL": services.base_url,
+            "SUMMARY_STATE_DIR": state_dir,
+            "LOG_LEVEL": log_level,
+        }
+    )
+    os.environ.pop("DISCORD_LOG_WEBHOOK_URL", None)
+    started = time.perf_counter()
+    spec = importlib.util.spec_from_file_location("daily_summary_bench", MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module, time.perf_counter() - started
+
+
+def warm_up(module):
+    # google-genai は初回の generate_summary で遅延読み込みされるので、
+    # 計測の前に読み込んでおき、その時間は別に報告する
+    started = time.perf_counter()
+    module.gemini_client()
+    elapsed = time.perf_counter() - started
+    # 状態DBのスキーマも作っておく（run_once が実行前の状態に戻すため）
+    with module._state_db():
+        pass
+    return elapsed
+
+
+def measure(services, fn):
+    # 時間と通信量だけを測る（tracemalloc は動かさない）
+    before = services.stats.snapshot()
+    started = time.perf_counter()
+    result = fn()
+    wall = time.perf_counter() - started
+    after = services.stats.snapshot()
+    return result, {
+        "wall_seconds": round(wall, 4),
+        "requests": after["request_total"] - before["request_total"],
+        "bytes_in": after["bytes_in"] - before["bytes_in"],
+        "bytes_out": after["bytes_out"] - before["bytes_out"],
+        "rate_limited": after["rate_limited"] - before["rate_limited"],
+    }
+
+
+def peak_memory(fn):
+    # ピークメモリは時間を測る実行とは別に、tracemalloc を有効にして測る
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+def _stages(module, run_index):
+    # (ステージ名, 前のステージの結果を受け取る関数) の並び
+    return [
+        ("collect_transcript", lambda _: module.collect_transcript()),
+        ("generate_summary", module.generate_summary),
+        (
+            "post_to_discord",
+            lambda summary: module.post_to_discord(
+                f"🗓️ ベンチマーク {run_index}\n\n{summary}",
+                run_key=f"bench-{run_index}",
+            ),
+        ),
+    ]
+
+
+def run_once(module, services, run_index):
+    # 時間を測るパスの後、状態ディレクトリを実行前に戻して同じ処理を
+    # tracemalloc 付きでもう一度流し、ピークメモリだけを取る（戻さないと
+    # 2回目は収集が差分取得・要約がキャッシュヒットになり、同じ条件にならない）
+    state_dir = module.STATE_DIR
+    with tempfile.TemporaryDirectory() as work:
+        before = os.path.join(work, "before")
+        after = os.path.join(work, "after")
+        shutil.copytree(state_dir, before)
+        stages = {}
+        result = None
+        for name, fn in _stages(module, run_index):
+            result, stages[name] = measure(services, lambda: fn(result))
+            if name == "collect_transcript":
+                transcript_chars = len(result.render())
+        requests_by_route = services.stats.snapshot()["requests"]
+        shutil.copytree(state_dir, after)
+
+        _restore(before, state_dir)
+        result = None
+        for name, fn in _stages(module, f"{run_index}-memory"):
+            result, stages[name]["peak_memory_bytes"] = peak_memory(lambda: fn(result))
+        # 次の実行は時間を測ったパスの後の状態から続ける
+        _restore(after, state_dir)
+
+    total = {
+        key: sum(stage[key] for stage in stages.values())
+        for key in ("wall_seconds", "requests", "bytes_in", "bytes_out", "rate_limited")
+    }
+    total["wall_seconds"] = round(total["wall_seconds"], 4)
+    total["peak_memory_bytes"] = max(s["peak_memory_bytes"] for s in stages.values())
+    return {
+        "transcript_chars": transcript_chars,
+        "stages": stages,
+        "total": total,
+        "requests_by_route": requests_by_route,
+    }
+
+
+def _restore(src, dst):
+    shutil.rmtree(dst)
+    shutil.copytree(src, dst)
+
+
+def print_report(report):
+    print(
+        f"guild: {report['guild']['channels']}ch × {report['guild']['threads']}th"
+        f" × {report['guild']['messages']}msg"
+        f" (total {report['guild']['total_messages']} messages)"
+        f"  import={report['import_seconds']:.3f}s"
+        f" sdk_import={report['sdk_import_seconds']:.3f}s"
+    )
+    header = (
+        f"{'run':>3} {'stage':<18} {'wall(s)':>9} {'req':>6}"
+        f" {'in(KB)':>9} {'out(KB)':>9} {'429':>5} {'peak(MB)':>9}"
+    )
+    print(header)
+    print("-" * len(header))
+    for i, run in enumerate(report["runs"]):
+        for name, st in list(run["stages"].items()) + [("total", run["total"])]:
+            print(
+                f"{i:>3} {name:<18} {st['wall_seconds']:>9.3f} {st['requests']:>6}"
+                f" {st['bytes_in'] / 1024:>9.1f} {st['bytes_out'] / 1024:>9.1f}"
+                f" {st['rate_limited']:>5} {st['peak_memory_bytes'] / 2**20:>9.2f}"
+            )
+
+
+def compare(report, baseline, tolerance):
+    # 最初の実行の各ステージを基準と比べ、許容幅を超えて悪化した項目を返す
+    regressions = []
+    current, previous = report["runs"][0]["stages"], baseline["runs"][0]["stages"]
+    for stage, st in current.items():
+        base = previous.get(stage)
+        if not base:
+            continue
+        for key in ("wall_seconds", "requests", "bytes_out", "peak_memory_bytes"):
+            if base[key] and st[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{stage}.{key}: {base[key]} -> {st[key]}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--bot-ratio", type=float, default=0.2)
+    parser.add_argument("--forbidden-ratio", type=float, default=0.05)
+    parser.add_argument("--bucket-limit", type=int, default=50)
+    parser.add_argument("--bucket-window", type=float, default=1.0)
+    parser.add_argument("--gemini-latency", type=float, default=0.2)
+    parser.add_argument(
+        "--runs", type=int, default=1, help="同じ状態ディレクトリで繰り返す回数"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    parser.add_argument("--baseline", help="比較対象の以前の結果JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    guild = SyntheticGuild(
+        args.channels,
+        args.threads,
+        args.messages,
+        bot_ratio=args.bot_ratio,
+        forbidden_ratio=args.forbidden_ratio,
+        seed=args.seed,
+    )
+    services = FakeServices(
+        guild,
+        bucket_limit=args.bucket_limit,
+        bucket_window=args.bucket_window,
+        gemini_latency=args.gemini_latency,
+    ).start()
+    try:
+        with tempfile.TemporaryDirectory() as state_dir:
+            module, import_seconds = load_module(services, state_dir, args.log_level)
+            sdk_import_seconds = warm_up(module)
+            runs = [run_once(module, services, i) for i in range(args.runs)]
+            module.flush_logs()
+    finally:
+        services.stop()
+
+    report = {
+        "guild": {
+            "channels": args.channels,
+            "threads": args.threads,
+            "messages": args.messages,
+            "total_messages": guild.total_messages,
+        },
+        "import_seconds": round(import_seconds, 4),
+        "sdk_import_seconds": round(sdk_import_seconds, 4),
+        "runs": runs,
+    }
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())